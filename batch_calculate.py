@@ -2,7 +2,8 @@ import time
 from typing import List
 
 from scripts.correlation_constants import Security, SharedMemoryCache, FredmdSeries, FredapiSeries, start_years
-from scripts.file_reading_funcs import pickle_securities_objects, get_fred_md_series_list, build_symbol_list
+from scripts.file_reading_funcs import pickle_securities_objects, get_fred_md_series_list, build_symbol_list, \
+    preload_series_data, clear_preloaded_series_data
 from scripts.calculate_correlations import CorrelationCalculator, define_top_correlations
 from scripts.plotting_functions import CorrelationPlotter
 
@@ -112,9 +113,13 @@ def make_securities_set(symbol_list):
     symbol_list = set(symbol_list)  # List of symbols to be converted into Securities
     securities_list = {Security(symbol) for symbol in symbol_list}  # Initialize Security list
 
-    # Populate series_data for each security
-    for security in securities_list:
-        security.set_series_data()
+    # Populate series_data for each security, reading all their parquets in one dataset scan rather than file by file
+    preload_series_data(symbol_list)
+    try:
+        for security in securities_list:
+            security.set_series_data()
+    finally:
+        clear_preloaded_series_data()
 
     # Filter out securities with None series_data
     filtered_securities_set = {security for security in securities_list if security.series_data is not None}
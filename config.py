@@ -1,5 +1,10 @@
+from functools import lru_cache
 from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
 import pandas as pd
+import pyarrow.csv as pv
 
 
 def find_project_root(current_path: Path) -> Path:
@@ -16,11 +21,39 @@ DATA_DIR = BASE_DIR / 'data'
 STOCKS_DIR = DATA_DIR / 'Stock_data'
 FRED_DIR = DATA_DIR / 'FRED'
 
-etf_metadata = pd.read_csv(STOCKS_DIR / 'FinDB/updated_fin_db_etf_data.csv', index_col='symbol')
-stock_metadata = pd.read_csv(STOCKS_DIR / 'FinDB/updated_fin_db_stock_data.csv', index_col='symbol')
-index_metadata = pd.read_csv(STOCKS_DIR / 'FinDB/updated_fin_db_indices_data.csv', index_col='symbol')
 
-securities_metadata = (etf_metadata, stock_metadata, index_metadata)
+def read_metadata_csv(path: Path) -> pd.DataFrame:
+    """Reads a FinDB metadata CSV indexed by symbol. Parsed by pyarrow's multithreaded reader, a few times faster than
+    pd.read_csv here, into the same frame: empty strings and the usual NA markers become NaN, quoted summaries may
+    contain newlines"""
+    table = pv.read_csv(path, parse_options=pv.ParseOptions(newlines_in_values=True),
+                        convert_options=pv.ConvertOptions(strings_can_be_null=True))
+    # pandas < 3 converts null strings to None rather than NaN, which would be read as the string 'None'
+    return table.to_pandas().fillna(np.nan).set_index('symbol')
 
-FRED_KEY = 'YOUR_API_KEY'
 
+class SecuritiesMetadata(NamedTuple):
+    etf_metadata: pd.DataFrame
+    stock_metadata: pd.DataFrame
+    index_metadata: pd.DataFrame
+
+
+@lru_cache(maxsize=None)
+def get_securities_metadata() -> SecuritiesMetadata:
+    """Reads the FinDB metadata on first use rather than at import, so processes that only need the paths don't
+    parse it. Shared by every caller, the frames must not be modified in place"""
+    return SecuritiesMetadata(etf_metadata=read_metadata_csv(STOCKS_DIR / 'FinDB/updated_fin_db_etf_data.csv'),
+                              stock_metadata=read_metadata_csv(STOCKS_DIR / 'FinDB/updated_fin_db_stock_data.csv'),
+                              index_metadata=read_metadata_csv(STOCKS_DIR / 'FinDB/updated_fin_db_indices_data.csv'))
+
+
+def __getattr__(name: str):
+    """Keeps config.etf_metadata, stock_metadata, index_metadata and securities_metadata working, loaded lazily"""
+    if name == 'securities_metadata':
+        return get_securities_metadata()
+    if name in SecuritiesMetadata._fields:
+        return getattr(get_securities_metadata(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+FRED_KEY = 'YOUR_API_KEY'
@@ -1,22 +1,30 @@
 import logging
-import logging
+import math
 import os
-from typing import List, Optional
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+from typing import AbstractSet, Any, Dict, FrozenSet, List, Optional, Sequence, Set, Tuple
 
 import dash
 import dash_bootstrap_components as dbc
+import numpy as np
 import pandas as pd
 import plotly.graph_objs as go
-from dash import dcc, html
-from dash.dependencies import Input, Output, State
+import plotly.io as pio
+from dash import dcc, html, Patch
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
 
 from batch_calculate import compute_security_correlations_and_plot
 from config import DATA_DIR
-from scripts.calculate_correlations import get_correlation_for_series
 from scripts.correlation_constants import Security, SharedMemoryCache, start_years, FredapiSeries, FredmdSeries
 from scripts.file_reading_funcs import load_saved_securities, read_series_data, original_get_validated_security_data, \
-    fit_data_to_time_range, get_all_fred_api_series_ids, get_all_fredmd_series_ids
-from scripts.plotting_functions import CorrelationPlotter, save_plot, normalize_data
+    fit_data_to_time_range, get_all_fred_api_series_ids, get_all_fredmd_series_ids, get_saved_correlation_years, \
+    SOURCE_FILE_SUFFIXES
+from scripts.numba_functions import select_filtered_indices
+from scripts.plotting_functions import CorrelationPlotter, save_plot, normalize_data, detrend_data
 
 formatter = logging.Formatter('%(levelname)s | %(message)s')
 handler = logging.StreamHandler()
@@ -26,6 +34,95 @@ logger.setLevel(logging.INFO)
 logger.addHandler(handler)
 logger.propagate = False
 
+# Layout styles, shared by every dashboard instance
+SOURCES_DIV_STYLE = {
+    'display': 'flex',
+    'background-color': '#003364',
+    'color': 'white',
+    'border': 'none',
+    'padding': '0px',
+    'font-size': '16px',
+    'cursor': 'pointer',
+}
+
+SOURCES_BUTTON_STYLE = {
+    'display': 'flex',
+    'background-color': '#003364',
+    'color': 'white',
+    'border': 'none',
+    'padding': '10px 20px',
+    'font-size': '16px',
+    'cursor': 'pointer',
+}
+
+ITEM_STYLE = {
+    'padding': '0 0 0 10px',
+    'margin': '0 0 0 0.2em',
+}  # Adjust the value to control the horizontal spacing
+
+SWITCH_STYLE = {
+    'padding': '0',
+    'margin': '0',
+}  # Adjust the value to control the horizontal spacing
+
+MULTI_DROPDOWN_STYLE = {
+    'backgroundColor': '#171717',
+    'color': '#fff',
+    'border': 'none',
+    'borderRadius': '5px',  # add border radius
+    'padding': '0.2em',  # add padding
+    'outline': 'none',
+}
+
+MULTI_DROPDOWN_DIV_STYLE = {
+    'margin': '0.3em 1em'
+}
+
+BUTTON_STYLE = {
+    'background-color': '#002A50',  # Change the background color
+    'color': 'white',  # Change the text color
+    'border': 'none',  # Remove the border
+    'outline': 'none',  # Remove the outline
+    'padding': '0.5em 1em',  # Add padding
+    'font-size': '16px',  # Change the font size
+    'cursor': 'pointer',  # Change cursor to indicate interactivity
+    'margin': '0'
+}
+
+DROPDOWN_DIV_STYLE = {'margin': '0.5em 2rem 0.5rem 0.1em'}
+
+DIV_STYLE_TOP_BLOCK = {'display': 'flex', 'justifyContent': 'center',
+                       'alignItems': 'center', 'margin': '0.5em 3.95em'}
+
+DIV_STYLE_TRI_SWITCH = {'display': 'flex', 'justifyContent': 'flex-start',
+                        'alignItems': 'center', 'margin': '0.5em 3.95em'}
+DIV_STYLE_INPUT = {'display': 'flex', 'justifyContent': 'flex-start', 'alignItems': 'center',
+                   'margin': '0.5em 0.1em'}
+
+DIV_STYLE_SWITCH = {
+    'display': 'flex',
+    'flexDirection': 'column',  # Set to 'column' for vertical alignment
+    'justifyContent': 'flex-start',  # Align items vertically to the top
+    'alignItems': 'center',
+    'margin': '0.5em 0.9em 0.5em 0.1em'
+}
+
+DIV_STYLE_INPUT_BOX = {
+    'display': 'flex',
+    'justifyContent': 'center',  # Align items vertically to the top
+    'alignItems': 'center',
+    'margin': '0.5em 0.1em'
+}
+
+DROPDOWN_CONTAINER_STYLE = {
+    'width': '11rem',
+    'margin': '0 1em 0 0'
+}
+
+TRI_SWITCH_STYLE = {"margin-bottom": "0.45em"}
+
+HTML_SWITCH_LABEL_STYLE = {'fontSize': '0.8em', 'padding': '0.1em', 'margin-bottom': '0.5em'}
+
 
 class SecurityDashboard:
     external_scripts = [
@@ -40,68 +137,101 @@ class SecurityDashboard:
         dbc.themes.BOOTSTRAP
     ]
 
-    LOAD_PLOT_BUTTON_ID = 'load-plot-button'
+    # Component IDs are interned, the trigger id is interned in update_graph too, so comparing them is an identity check
+    LOAD_PLOT_BUTTON_ID = sys.intern('load-plot-button')
 
-    SECURITIES_INPUT_ID = 'security_input'
-    SECURITIES_DROPDOWN_ID = 'security-dropdown'
+    SECURITIES_INPUT_ID = sys.intern('security_input')
+    SECURITIES_DROPDOWN_ID = sys.intern('security-dropdown')
 
-    DROPDOWN_RADIO_ID = 'dropdown_radio'
+    DROPDOWN_RADIO_ID = sys.intern('dropdown_radio')
 
-    ADD_TRACE_ID = 'add_trace'
+    ADD_TRACE_ID = sys.intern('add_trace')
 
-    START_DATE_ID = 'start_date_dropdown'
-    NUM_TRACES_ID = 'num_traces_id'
+    START_DATE_ID = sys.intern('start_date_dropdown')
+    NUM_TRACES_ID = sys.intern('num_traces_id')
 
-    SOURCE_ETF_ID = 'source_etf'
-    SOURCE_STOCK_ID = 'source_stock'
-    SOURCE_INDEX_ID = 'source_index'
+    SOURCE_ETF_ID = sys.intern('source_etf')
+    SOURCE_STOCK_ID = sys.intern('source_stock')
+    SOURCE_INDEX_ID = sys.intern('source_index')
 
-    DETREND_SWITCH_ID = 'detrend-switch'
-    MONTHLY_SWITCH_ID = 'monthly-switch'
-    OTC_FILTER_ID = 'otc-filter'
+    DETREND_SWITCH_ID = sys.intern('detrend-switch')
+    MONTHLY_SWITCH_ID = sys.intern('monthly-switch')
+    OTC_FILTER_ID = sys.intern('otc-filter')
 
     # Metadata Filters
-    SECTOR_FILTER_ID = 'sector-filter'
-    INDUSTRY_GROUP_FILTER_ID = 'industry-group-filter'
-    INDUSTRY_FILTER_ID = 'industry-filter'
-    COUNTRY_FILTER_ID = 'country-filter'
-    STATE_FILTER_ID = 'state-filter'
-    MARKET_CAP_FILTER_ID = 'market-cap-filter'
-
-    PLOT_ID = 'security_plot'
-    LATEX_ID = 'latex_equation'
+    SECTOR_FILTER_ID = sys.intern('sector-filter')
+    INDUSTRY_GROUP_FILTER_ID = sys.intern('industry-group-filter')
+    INDUSTRY_FILTER_ID = sys.intern('industry-filter')
+    COUNTRY_FILTER_ID = sys.intern('country-filter')
+    STATE_FILTER_ID = sys.intern('state-filter')
+    MARKET_CAP_FILTER_ID = sys.intern('market-cap-filter')
+
+    PLOT_ID = sys.intern('security_plot')
+    LATEX_ID = sys.intern('latex_equation')
+
+    # Security attributes that the metadata filter dropdowns are built from
+    FILTER_ATTRIBUTES = ('sector', 'industry_group', 'industry', 'country', 'state', 'market_cap')
+    # Inputs that reset the filter dropdowns, the metadata filters aren't applied when one of them triggers a change
+    FILTER_RESET_TRIGGER_IDS = frozenset({NUM_TRACES_ID, SOURCE_ETF_ID, SOURCE_STOCK_ID, SOURCE_INDEX_ID,
+                                          START_DATE_ID})
+    SKIP_METADATA_FILTER_TRIGGER_IDS = FILTER_RESET_TRIGGER_IDS | {SECURITIES_DROPDOWN_ID}
 
     SECURITIES_SOURCE = 'SECURITIES'
     FREDMD_SOURCE = 'FREDMD'
     FREDAPI_SOURCE = 'FREDAPI'
     FREDAPIOG_SOURCE = 'FREDAPIOG'
+    FRED_SOURCES = frozenset({FREDMD_SOURCE, FREDAPI_SOURCE, FREDAPIOG_SOURCE})
+    FRED_PICKLE_SUFFIXES = tuple(suffix for suffix in SOURCE_FILE_SUFFIXES.values() if suffix)  # '_fred', ...
+
+    FIGURE_CACHE_SIZE = 32  # Number of recently rendered figures kept for reuse
 
     def __init__(self, data_dir):
         self.DEBUG: bool = True
+        self._debug_dump: bool = False  # Append filter arguments to ui/debug_file*.txt on every filter change
         self.data_dir = data_dir
-        self.cache = SharedMemoryCache()
+        self.cache = SharedMemoryCache(maxsize=256)  # Bounded, the dashboard is a long-running process
         self.plotter = CorrelationPlotter()
 
+        # (directory mtime, all saved symbols, non-FRED saved symbols) from the last pickle directory scan
+        self._pickle_scan: Optional[Tuple[int, List[str], List[str]]] = None
+
         # Tracks which have already been calculated
         self.all_available_securities: List[str] = self.get_all_available_securities()
 
         self.available_securities: List[str] = self.get_available_securities()  # Doesn't include FRED series
 
-        self.fredmd_metrics: List[str] = get_all_fredmd_series_ids()
-        self.fred_api_metrics: List[str] = get_all_fred_api_series_ids()
-        self.fred_api_unrevised_metrics: List[str] = get_all_fred_api_series_ids()
+        # The FRED id lists never change while the dashboard runs, so they are tuples with frozenset mirrors
+        self.fredmd_metrics: Tuple[str, ...] = tuple(get_all_fredmd_series_ids())
+        self.fred_api_metrics: Tuple[str, ...] = tuple(get_all_fred_api_series_ids())
+        self.fred_api_unrevised_metrics: Tuple[str, ...] = self.fred_api_metrics  # Same ids, read the file once
+
+        # Set mirrors of the lists above for O(1) membership checks, the securities ones kept in sync on every append
+        self._all_available_set: Set[str] = set(self.all_available_securities)
+        self._available_set: Set[str] = set(self.available_securities)
+        self._fredmd_set: FrozenSet[str] = frozenset(self.fredmd_metrics)
+        self._fred_api_set: FrozenSet[str] = frozenset(self.fred_api_metrics)
+        self._fred_api_unrevised_set: FrozenSet[str] = self._fred_api_set
+
+        # Dropdown source -> (symbols it lists, set mirror of them)
+        self._source_symbols: Dict[str, Tuple[Sequence[str], AbstractSet[str]]] = {
+            self.SECURITIES_SOURCE: (self.available_securities, self._available_set),
+            self.FREDMD_SOURCE: (self.fredmd_metrics, self._fredmd_set),
+            self.FREDAPI_SOURCE: (self.fred_api_metrics, self._fred_api_set),
+            self.FREDAPIOG_SOURCE: (self.fred_api_unrevised_metrics, self._fred_api_unrevised_set),
+        }
 
-        if not self.available_securities:  # If there is nothing saved to disk
-            compute_security_correlations_and_plot(cache=self.cache, symbol_list=['GME'], debug=True)
         self.available_start_dates: List[str] = start_years
 
         self.dropdown_source = self.SECURITIES_SOURCE
 
-        self.main_security: Security = load_saved_securities('GME', self.dropdown_source)
+        # Loaded in the background by load_main_security, the layout waits for it before it's first served
+        self.main_security: Optional[Security] = None
+        self._main_security_loaded = threading.Event()
+        self._main_security_error: Optional[BaseException] = None
+        self._layout: Optional[html.Div] = None
 
-        self.input_symbol: str = self.main_security.symbol
-        self.dropdown_symbol: str = self.main_security.symbol
-        self.dropdown_options: List[str] = self.available_securities
+        self.input_symbol: str = 'GME'
+        self.dropdown_symbol: str = 'GME'
         self.latex_equation: str = ''
 
         self.add_trace = []
@@ -120,14 +250,39 @@ class SecurityDashboard:
         self.displayed_positively_correlated: List[Security] = []
         self.displayed_negatively_correlated: List[Security] = []
 
-        self.sectors: List[str] = self.main_security.get_unique_values('sector', self.start_date)
-        self.industry_groups = self.main_security.get_unique_values('industry_group', self.start_date)
-        self.industries = self.main_security.get_unique_values('industry', self.start_date)
-        self.countries = self.main_security.get_unique_values('country', self.start_date)
-        self.states = self.main_security.get_unique_values('state', self.start_date)
-        self.market_caps = self.main_security.get_unique_values('market_cap', self.start_date)
-
-        self.plot = self.load_initial_plot()  # Load initial plot
+        # Values derived from main_security, cleared by sync_main_security_caches whenever main_security changes
+        self._main_security_cache_owner: Optional[Security] = None
+        self._correlation_columns: Dict[str, Tuple[Dict[str, Any], Dict[str, Any]]] = {}
+        self._main_detrended_arrays: Dict[str, Tuple[pd.DatetimeIndex, np.ndarray, float]] = {}
+        self._added_trace_correlations: Dict[Tuple[str, str], float] = {}
+
+        # Filled in from main_security by load_main_security
+        self.sectors: List[str] = []
+        self.industry_groups: List[str] = []
+        self.industries: List[str] = []
+        self.countries: List[str] = []
+        self.states: List[str] = []
+        self.market_caps: List[str] = []
+        # Dropdown options of the filter lists above, in FILTER_ATTRIBUTES order. Rebuilt only when the lists change
+        self._filter_options: Tuple[Tuple[Dict[str, str], ...], ...] = tuple(() for _ in self.FILTER_ATTRIBUTES)
+        # Dropdown source -> (number of symbols the options were built from, options)
+        self._source_options: Dict[str, Tuple[int, Tuple[Dict[str, str], ...]]] = {}
+        self.dropdown_options: Tuple[Dict[str, str], ...] = self.get_source_options(self.dropdown_source)
+
+        # Filter options are recomputed lazily (see build_response) and memoized per main security and start date
+        self._filter_options_dirty: bool = False
+        self._filter_options_cache: Dict[Tuple[int, str], Tuple[Security, Tuple[List[str], ...],
+                                                                 Tuple[Tuple[Dict[str, str], ...], ...]]] = {}
+
+        # Rendered figures keyed by main security and plot configuration, least recently used first
+        # Entries also hold the figure's plotly JSON dict, so sending a cached figure again skips converting it
+        self._figure_cache: OrderedDict[tuple, Tuple[Security, go.Figure, dict]] = OrderedDict()
+        self._plot_json: Optional[Tuple[go.Figure, dict]] = None  # (figure, its JSON dict) of the last cached plot
+
+        # Dash serializes callback outputs through plotly's JSON encoder, orjson is much faster on the figures' arrays
+        pio.json.config.default_engine = 'orjson'
+
+        self.plot: Optional[go.Figure] = None
         self.app = dash.Dash(__name__, external_scripts=self.external_scripts,
                              external_stylesheets=self.external_stylesheets, assets_folder='ui/assets')
         self.app.scripts.config.serve_locally = True
@@ -135,8 +290,60 @@ class SecurityDashboard:
         self.setup_layout()
         self.setup_callbacks()
 
+        # The server can start listening while the initial security and plot are loaded
+        threading.Thread(target=self.load_main_security, daemon=True).start()
+
+    def load_main_security(self):
+        """Loads the initial security, its filter values and the initial plot, then unblocks serve_layout"""
+        try:
+            if 'GME' not in self._available_set:  # The initial security hasn't been saved to disk yet
+                compute_security_correlations_and_plot(cache=self.cache, symbol_list=['GME'], debug=True)
+                self.available_securities.append('GME')
+                self._available_set.add('GME')
+                self.all_available_securities.append('GME')
+                self._all_available_set.add('GME')
+                self.dropdown_options = self.get_source_options(self.dropdown_source)  # Offer the new GME too
+
+            self.main_security = load_saved_securities('GME', self.dropdown_source)
+
+            unique_values = self.main_security.get_all_unique_values(self.FILTER_ATTRIBUTES, self.start_date)
+            self.sectors = unique_values['sector']
+            self.industry_groups = unique_values['industry_group']
+            self.industries = unique_values['industry']
+            self.countries = unique_values['country']
+            self.states = unique_values['state']
+            self.market_caps = unique_values['market_cap']
+            self._filter_options = tuple(self.to_dropdown_options(unique_values[attribute])
+                                         for attribute in self.FILTER_ATTRIBUTES)
+
+            self.plot = self.load_initial_plot()  # Load initial plot
+        except BaseException as e:
+            self._main_security_error = e  # Re-raised by serve_layout so the failure isn't silently swallowed
+            raise
+        finally:
+            self._main_security_loaded.set()
+
     def load_initial_plot(self):
-        logger.debug("Initial Security Object: ", self.main_security.__repr__(), self.start_date, self.num_traces)
+        """Plots the initial security, reusing the figure pickled by an earlier run if its security hasn't been saved
+        again since"""
+        logger.debug("Initial Security Object: %r, %s, %s", self.main_security, self.start_date, self.num_traces)
+        symbol = self.main_security.symbol
+        security_path = self.data_dir / \
+            f'Graphs/pickled_securities_objects/{symbol}{SOURCE_FILE_SUFFIXES[self.dropdown_source]}.pkl'
+        plot_path = self.data_dir / \
+            f'Graphs/pickled_plots/{symbol}_{self.dropdown_source}_{self.start_date}_{self.num_traces}.pkl'
+        security_mtime = os.stat(security_path).st_mtime_ns
+
+        try:
+            with open(plot_path, 'rb') as plot_file:
+                saved_mtime, fig = pickle.load(plot_file)
+            if saved_mtime == security_mtime:
+                return fig
+        except FileNotFoundError:
+            pass  # No saved plot yet, build it below
+        except Exception as e:  # Unreadable, e.g. pickled by another plotly or pandas version, rebuild and replace it
+            logger.warning("Rebuilding unreadable saved plot %s: %r", plot_path, e)
+
         fig = self.plotter.plot_security_correlations(
             main_security=self.main_security,
             start_date=self.start_date,
@@ -152,109 +359,89 @@ class SecurityDashboard:
             otc_filter=False,
         )
 
+        # Written to a temporary file that then replaces the saved plot, so a crash mid-write can't leave a bad file
+        temp_path = plot_path.with_name(plot_path.name + '.tmp')
+        with open(temp_path, 'wb') as plot_file:
+            pickle.dump((security_mtime, fig), plot_file)
+        os.replace(temp_path, plot_path)
+
         return fig
 
+    @staticmethod
+    def to_dropdown_options(values: Sequence[str]) -> Tuple[Dict[str, str], ...]:
+        """Options are shared between responses and memos, the tuple keeps them from being modified in place"""
+        return tuple({'label': value, 'value': value} for value in values)
+
+    def get_filter_values(self) -> Tuple[List[str], ...]:
+        """The current values of the filter dropdowns, in FILTER_ATTRIBUTES order"""
+        return self.sectors, self.industry_groups, self.industries, self.countries, self.states, self.market_caps
+
+    def get_source_options(self, source: str) -> Tuple[Dict[str, str], ...]:
+        """Dropdown options for a source's symbols, rebuilt only after symbols have been appended to it"""
+        symbols = self._source_symbols[source][0]
+        cached = self._source_options.get(source)
+        if cached is None or cached[0] != len(symbols):  # The symbol lists are only ever appended to
+            cached = (len(symbols), self.to_dropdown_options(symbols))
+            self._source_options[source] = cached
+        return cached[1]
+
+    def scan_pickled_securities(self) -> Tuple[List[str], List[str]]:
+        """Lists the saved symbols in a single directory pass, rescanning only when the directory has changed"""
+        pickle_dir = self.data_dir / 'Graphs/pickled_securities_objects/'
+        mtime = os.stat(pickle_dir).st_mtime_ns
+        if self._pickle_scan is None or self._pickle_scan[0] != mtime:
+            all_symbols, security_symbols = [], []
+            with os.scandir(pickle_dir) as entries:
+                for name in (entry.name for entry in entries):
+                    if name.endswith('.pkl'):
+                        symbol = name[:-4]
+                        all_symbols.append(symbol)
+                        if not symbol.endswith(self.FRED_PICKLE_SUFFIXES):  # One C-level check for every suffix
+                            security_symbols.append(symbol)
+            self._pickle_scan = (mtime, all_symbols, security_symbols)
+        return self._pickle_scan[1], self._pickle_scan[2]
+
     def get_available_securities(self) -> List[str]:
-        return [file.split('.')[0] for file in os.listdir(self.data_dir / 'Graphs/pickled_securities_objects/') if
-                file.endswith('.pkl') and not (file.endswith('_fred.pkl') or file.endswith('_fredapi.pkl') or
-                                               file.endswith('_fredapi_og.pkl'))]
+        return list(self.scan_pickled_securities()[1])
 
     def get_all_available_securities(self) -> List[str]:
-        return [file.split('.')[0] for file in os.listdir(self.data_dir / 'Graphs/pickled_securities_objects/') if
-                file.endswith('.pkl')]
-
-    def setup_layout(self):
-        main_security = self.main_security
-
-        sources_div_style = {
-            'display': 'flex',
-            'background-color': '#003364',
-            'color': 'white',
-            'border': 'none',
-            'padding': '0px',
-            'font-size': '16px',
-            'cursor': 'pointer',
-        }
-
-        sources_button_style = {
-            'display': 'flex',
-            'background-color': '#003364',
-            'color': 'white',
-            'border': 'none',
-            'padding': '10px 20px',
-            'font-size': '16px',
-            'cursor': 'pointer',
-        }
-
-        item_style = {
-            'padding': '0 0 0 10px',
-            'margin': '0 0 0 0.2em',
-        }  # Adjust the value to control the horizontal spacing
-
-        switch_style = {
-            'padding': '0',
-            'margin': '0',
-        }  # Adjust the value to control the horizontal spacing
-
-        multi_dropdown_style = {
-            'backgroundColor': '#171717',
-            'color': '#fff',
-            'border': 'none',
-            'borderRadius': '5px',  # add border radius
-            'padding': '0.2em',  # add padding
-            'outline': 'none',
-        }
-
-        multi_dropdown_div_style = {
-            'margin': '0.3em 1em'
-        }
-
-        button_style = {
-            'background-color': '#002A50',  # Change the background color
-            'color': 'white',  # Change the text color
-            'border': 'none',  # Remove the border
-            'outline': 'none',  # Remove the outline
-            'padding': '0.5em 1em',  # Add padding
-            'font-size': '16px',  # Change the font size
-            'cursor': 'pointer',  # Change cursor to indicate interactivity
-            'margin': '0'
-        }
-
-        dropdown_div_style = {'margin': '0.5em 2rem 0.5rem 0.1em'}
-
-        div_style_top_block = {'display': 'flex', 'justifyContent': 'center',
-                               'alignItems': 'center', 'margin': '0.5em 3.95em'}
-
-        div_style_tri_switch = {'display': 'flex', 'justifyContent': 'flex-start',
-                                'alignItems': 'center', 'margin': '0.5em 3.95em'}
-        div_style_input = {'display': 'flex', 'justifyContent': 'flex-start', 'alignItems': 'center',
-                           'margin': '0.5em 0.1em'}
-
-        div_style_switch = {
-            'display': 'flex',
-            'flexDirection': 'column',  # Set to 'column' for vertical alignment
-            'justifyContent': 'flex-start',  # Align items vertically to the top
-            'alignItems': 'center',
-            'margin': '0.5em 0.9em 0.5em 0.1em'
-        }
+        return list(self.scan_pickled_securities()[0])
 
-        div_style_input_box = {
-            'display': 'flex',
-            'justifyContent': 'center',  # Align items vertically to the top
-            'alignItems': 'center',
-            'margin': '0.5em 0.1em'
-        }
-
-        dropdown_container_style = {
-            'width': '11rem',
-            'margin': '0 1em 0 0'
-        }
-
-        tri_switch_style = {"margin-bottom": "0.45em"}
-
-        html_switch_label_style = {'fontSize': '0.8em', 'padding': '0.1em', 'margin-bottom': '0.5em'}
+    @staticmethod
+    def make_filter_dropdown(label: str, dropdown_id: str, options: Tuple[Dict[str, str], ...],
+                             values: List[str]) -> html.Div:
+        """Labelled multi-select dropdown for one of the stock metadata filters"""
+        return html.Div([
+            html.Label(label),
+            dcc.Dropdown(
+                id=dropdown_id,
+                options=options,
+                value=values,
+                multi=True,  # allow multiple selection
+                style=MULTI_DROPDOWN_STYLE,
+            ),
+        ], style=MULTI_DROPDOWN_DIV_STYLE)
 
-        self.app.layout = html.Div([
+    def setup_layout(self):
+        # Dash calls a function layout as soon as it's assigned to collect the component ids, unless validation_layout
+        # is set. serve_layout waits for main_security, which only starts loading after __init__, so the ids come from
+        # a skeleton built before it's loaded instead
+        self.app.validation_layout = self.build_layout()
+        self.app.layout = self.serve_layout  # Built on the first page load, once main_security has been loaded
+
+    def serve_layout(self) -> html.Div:
+        self._main_security_loaded.wait()
+        if self._main_security_error is not None:
+            raise RuntimeError("Loading the initial security failed") from self._main_security_error
+        if self._layout is None:
+            self._layout = self.build_layout()
+        return self._layout
+
+    def build_layout(self) -> html.Div:
+        """The dashboard's components filled in from the current state, placeholders while main_security isn't loaded"""
+        main_symbol = self.main_security.symbol if self.main_security is not None else None
+
+        return html.Div([
 
             html.Div([
                 html.Div([
@@ -266,31 +453,30 @@ class SecurityDashboard:
                                       style={
                                           'width': '11em',
                                       }),
-                        ], style=dropdown_container_style),
+                        ], style=DROPDOWN_CONTAINER_STYLE),
                         html.Div([
-                            html.Label('Load New Series', style=html_switch_label_style),
+                            html.Label('Load New Series', style=HTML_SWITCH_LABEL_STYLE),
                             dcc.Checklist(
                                 id=self.ADD_TRACE_ID,
                                 options=[{'label': '', 'value': 'add_trace'}],
                                 value=self.add_trace,
                                 inline=True,
                                 className='custom-switch',
-                                style=switch_style,  # Apply item_style to the element
+                                style=SWITCH_STYLE,  # Apply ITEM_STYLE to the element
                                 labelStyle={'display': 'flex', 'justifyContent': 'center'},  # vertical align the label
                             ),
-                            html.Label('Add Series to Plot', style=html_switch_label_style),
-                        ], style=div_style_input_box),
-                    ], style=div_style_input),
+                            html.Label('Add Series to Plot', style=HTML_SWITCH_LABEL_STYLE),
+                        ], style=DIV_STYLE_INPUT_BOX),
+                    ], style=DIV_STYLE_INPUT),
                     html.Div([
                         html.Div([
                             dcc.Dropdown(
                                 id=self.SECURITIES_DROPDOWN_ID,
-                                options=[{'label': security, 'value': security} for security in
-                                         self.available_securities],
-                                value=main_security.symbol,  # Use the random security here
+                                options=self.dropdown_options,
+                                value=main_symbol,  # Use the random security here
                                 style={'width': '11em'},
                             ),
-                        ], style=dropdown_container_style),
+                        ], style=DROPDOWN_CONTAINER_STYLE),
                         #  Changes dropdown options from being regular stocks to being fred-md series
                         html.Div([
                             dcc.RadioItems(
@@ -305,10 +491,10 @@ class SecurityDashboard:
                                 labelStyle={'display': 'block', 'margin': '0 0.2em'},
                                 style={'fontSize': '0.8em', 'padding': '0.1em'}
                             )
-                        ], style=div_style_switch)
-                    ], style=div_style_input)
+                        ], style=DIV_STYLE_SWITCH)
+                    ], style=DIV_STYLE_INPUT)
 
-                ], style=dropdown_div_style),
+                ], style=DROPDOWN_DIV_STYLE),
 
                 html.Div([
                     html.Label('Start Year', style={'fontSize': '0.8em', 'padding': '0.1em'}),
@@ -322,7 +508,7 @@ class SecurityDashboard:
                             'width': '8rem',
                         }
                     ),
-                ], style=div_style_switch),
+                ], style=DIV_STYLE_SWITCH),
 
                 html.Div([
                     html.Label('Num Shown', style={'fontSize': '0.8em', 'padding': '0.1em'}),
@@ -335,7 +521,7 @@ class SecurityDashboard:
                             'width': '5rem',
                         },
                     ),
-                ], style=div_style_switch),
+                ], style=DIV_STYLE_SWITCH),
 
                 html.Div([
                     dcc.Checklist(
@@ -344,112 +530,61 @@ class SecurityDashboard:
                         value=self.otc_filter,
                         inline=True,
                         className='custom-switch',
-                        style=item_style,  # Apply item_style to the element
+                        style=ITEM_STYLE,  # Apply ITEM_STYLE to the element
                         labelStyle={'display': 'flex', 'alignItems': 'center'},  # vertically align the label
                     ),
-                    html.Label('Exclude OTC', style=tri_switch_style),
+                    html.Label('Exclude OTC', style=TRI_SWITCH_STYLE),
                     dcc.Checklist(
                         id=self.DETREND_SWITCH_ID,
                         options=[{'label': '', 'value': 'detrend'}],
                         value=self.show_detrended,
                         inline=True,
                         className='custom-switch',
-                        style=item_style,
+                        style=ITEM_STYLE,
                         labelStyle={'display': 'flex', 'alignItems': 'center'},  # vertically align the label
                     ),
-                    html.Label('Show Detrended', style=tri_switch_style),
+                    html.Label('Show Detrended', style=TRI_SWITCH_STYLE),
                     dcc.Checklist(
                         id=self.MONTHLY_SWITCH_ID,
                         options=[{'label': '', 'value': 'monthly'}],
                         value=self.monthly_resample,
                         inline=True,
                         className='custom-switch',
-                        style=item_style,
+                        style=ITEM_STYLE,
                         labelStyle={'display': 'flex', 'alignItems': 'center'},  # vertically align the label
                     ),
-                    html.Label('Monthly Resample', style=tri_switch_style),
-                ], style=div_style_tri_switch),
-            ], style=div_style_top_block,
+                    html.Label('Monthly Resample', style=TRI_SWITCH_STYLE),
+                ], style=DIV_STYLE_TRI_SWITCH),
+            ], style=DIV_STYLE_TOP_BLOCK,
             ),
 
             # Checklist to include ETFs, Stocks, and/or Indices
             html.Div([
-                html.Button('ETF', id=self.SOURCE_ETF_ID, n_clicks=1, style=sources_button_style),
-                html.Button('Stock', id=self.SOURCE_STOCK_ID, n_clicks=1, style=sources_button_style),
-                html.Button('Index', id=self.SOURCE_INDEX_ID, n_clicks=1, style=sources_button_style),
-            ], style=sources_div_style),
+                html.Button('ETF', id=self.SOURCE_ETF_ID, n_clicks=1, style=SOURCES_BUTTON_STYLE),
+                html.Button('Stock', id=self.SOURCE_STOCK_ID, n_clicks=1, style=SOURCES_BUTTON_STYLE),
+                html.Button('Index', id=self.SOURCE_INDEX_ID, n_clicks=1, style=SOURCES_BUTTON_STYLE),
+            ], style=SOURCES_DIV_STYLE),
 
             html.Button(  # Button for toggling filters
                 "Toggle Stock Filters",
                 id="collapse-button",
                 className="mb-3",
-                style=button_style,
+                style=BUTTON_STYLE,
             ),
             dbc.Collapse(
                 [
-                    # Add Sector Filter
-                    html.Div([
-                        html.Label('Sector Filter'),
-                        dcc.Dropdown(
-                            id=self.SECTOR_FILTER_ID,
-                            options=[{'label': sector, 'value': sector} for sector in self.sectors],
-                            value=self.sectors,
-                            multi=True,
-                            style=multi_dropdown_style,
-                        ),
-                    ], style=multi_dropdown_div_style),
-                    # Add Industry Group Filter
-                    html.Div([
-                        html.Label('Industry Group Filter'),
-                        dcc.Dropdown(
-                            id=self.INDUSTRY_GROUP_FILTER_ID,
-                            options=[{'label': group, 'value': group} for group in self.industry_groups],
-                            value=self.industry_groups,
-                            multi=True,  # allow multiple selection
-                            style=multi_dropdown_style,
-                        ),
-                    ], style=multi_dropdown_div_style),
-                    html.Div([
-                        html.Label('Industry Filter'),
-                        dcc.Dropdown(
-                            id=self.INDUSTRY_FILTER_ID,
-                            options=[{'label': industry, 'value': industry} for industry in self.industries],
-                            value=self.industries,
-                            multi=True,
-                            style=multi_dropdown_style,
-                        ),
-                    ], style=multi_dropdown_div_style),
-                    html.Div([
-                        html.Label('Country Filter'),
-                        dcc.Dropdown(
-                            id=self.COUNTRY_FILTER_ID,
-                            options=[{'label': country, 'value': country} for country in self.countries],
-                            value=self.countries,
-                            multi=True,
-                            style=multi_dropdown_style,
-                        ),
-                    ], style=multi_dropdown_div_style),
-                    html.Div([
-                        html.Label('State Filter'),
-                        dcc.Dropdown(
-                            id=self.STATE_FILTER_ID,
-                            options=[{'label': state, 'value': state} for state in self.states],
-                            value=self.states,
-                            multi=True,
-                            style=multi_dropdown_style,
-                        ),
-                    ], style=multi_dropdown_div_style),
-                    html.Div([
-                        html.Label('Market Cap Filter'),
-                        dcc.Dropdown(
-                            id=self.MARKET_CAP_FILTER_ID,
-                            options=[{'label': market_cap, 'value': market_cap} for market_cap in
-                                     self.market_caps],
-                            value=self.market_caps,
-                            multi=True,
-                            style=multi_dropdown_style,
-                        ),
-                    ], style=multi_dropdown_div_style),
+                    self.make_filter_dropdown('Sector Filter', self.SECTOR_FILTER_ID,
+                                              self._filter_options[0], self.sectors),
+                    self.make_filter_dropdown('Industry Group Filter', self.INDUSTRY_GROUP_FILTER_ID,
+                                              self._filter_options[1], self.industry_groups),
+                    self.make_filter_dropdown('Industry Filter', self.INDUSTRY_FILTER_ID,
+                                              self._filter_options[2], self.industries),
+                    self.make_filter_dropdown('Country Filter', self.COUNTRY_FILTER_ID,
+                                              self._filter_options[3], self.countries),
+                    self.make_filter_dropdown('State Filter', self.STATE_FILTER_ID,
+                                              self._filter_options[4], self.states),
+                    self.make_filter_dropdown('Market Cap Filter', self.MARKET_CAP_FILTER_ID,
+                                              self._filter_options[5], self.market_caps),
                 ],
                 id="collapse",
             ),
@@ -458,7 +593,7 @@ class SecurityDashboard:
             html.Button(
                 'Reload',
                 id=self.LOAD_PLOT_BUTTON_ID,
-                style=button_style,
+                style=BUTTON_STYLE,
             ),
 
             html.Div([
@@ -504,16 +639,12 @@ class SecurityDashboard:
             'flexDirection': 'column',
         })
 
-    @staticmethod
-    def toggle_collapse(n, is_open):
-        if n is None:
-            return is_open
-        return not is_open
-
     # Switch the dropdown values between Securities and FRED macroeconomic indicators
     def setup_callbacks(self):
 
-        @self.app.callback(
+        # Both run in the browser (ui/assets/clientside.js), they only restyle and don't need a server round trip
+        self.app.clientside_callback(
+            ClientsideFunction(namespace='clientside', function_name='update_button_styles'),
             [
                 Output(self.SOURCE_ETF_ID, 'style'),
                 Output(self.SOURCE_STOCK_ID, 'style'),
@@ -525,24 +656,13 @@ class SecurityDashboard:
                 Input(self.SOURCE_INDEX_ID, 'n_clicks'),
             ],
         )
-        def update_button_styles(etf_clicks, stock_clicks, index_clicks):  # Makes STOCK ETF INDEX buttons change color
-            selected_style = {'flex': 1, 'background-color': '#00498B', 'color': 'white'}
-            not_selected_style = {'flex': 1, 'background-color': '#1e1e2a', 'color': 'white'}
-
-            etf_style = selected_style if etf_clicks % 2 == 1 else not_selected_style
-            stock_style = selected_style if stock_clicks % 2 == 1 else not_selected_style
-            index_style = selected_style if index_clicks % 2 == 1 else not_selected_style
-
-            return etf_style, stock_style, index_style
 
-        # Collapse the filtering buttons when the "Toggle Filters" button is clicked
-        @self.app.callback(
+        self.app.clientside_callback(
+            ClientsideFunction(namespace='clientside', function_name='toggle_collapse'),
             Output("collapse", "is_open"),
             Input("collapse-button", "n_clicks"),
             State("collapse", "is_open"),
         )
-        def toggle_collapse_callback(n, is_open):
-            return self.toggle_collapse(n, is_open)
 
         # Update the graph... Beware, spaghetti code ahead
         @self.app.callback(
@@ -641,10 +761,18 @@ class SecurityDashboard:
                 add_trace = self.add_trace
 
             ctx = dash.callback_context
-            if self.DEBUG:
+            triggered_id = ctx.triggered_id  # Property that re-parses the triggered inputs on every access
+            if isinstance(triggered_id, str):
+                triggered_id = sys.intern(triggered_id)
+            if self.DEBUG and logger.isEnabledFor(logging.DEBUG):  # Only logs, skip it when nothing would be shown
                 check_changes(dropdown_symbol, dropdown_source, add_trace, start_date, num_traces, etf_clicks,
                               stock_clicks, index_clicks, detrend_plot, monthly, otc_filter)
 
+            # Interned so the many symbol comparisons below and in later callbacks are identity checks
+            if input_symbol is not None:
+                input_symbol = sys.intern(input_symbol)
+            if dropdown_symbol is not None:
+                dropdown_symbol = sys.intern(dropdown_symbol)
             self.input_symbol = input_symbol
             self.dropdown_symbol = dropdown_symbol
 
@@ -662,80 +790,51 @@ class SecurityDashboard:
 
             self.otc_filter = otc_filter  #
 
-            if ctx.triggered_id == self.DROPDOWN_RADIO_ID:
+            if triggered_id == self.DROPDOWN_RADIO_ID:
                 logger.debug('Dropdown triggered')
-                if self.dropdown_source == self.SECURITIES_SOURCE:
-                    self.dropdown_options = [{'label': security, 'value': security} for security in
-                                             self.available_securities]
-                elif self.dropdown_source == self.FREDMD_SOURCE:
-                    self.dropdown_options = [{'label': security, 'value': security} for security in
-                                             self.fredmd_metrics]
-                elif self.dropdown_source == self.FREDAPI_SOURCE:
-                    self.dropdown_options = [{'label': security, 'value': security} for security in
-                                             self.fred_api_metrics]
-                elif self.dropdown_source == self.FREDAPIOG_SOURCE:
-                    self.dropdown_options = [{'label': security, 'value': security} for security in
-                                             self.fred_api_unrevised_metrics]
+                if self.dropdown_source in self._source_symbols:
+                    self.dropdown_options = self.get_source_options(self.dropdown_source)
 
                 self.etf = True
                 self.stock = True
                 self.index = True
 
-                return self.plot, '', self.dropdown_symbol, self.dropdown_options, self.latex_equation, 1, 1, 1, \
-                       [{'label': sector, 'value': sector} for sector in self.sectors], \
-                       [{'label': group, 'value': group} for group in self.industry_groups], \
-                       [{'label': industry, 'value': industry} for industry in self.industries], \
-                       [{'label': country, 'value': country} for country in self.countries], \
-                       [{'label': state, 'value': state} for state in self.states], \
-                       [{'label': market_cap, 'value': market_cap} for market_cap in self.market_caps], \
-                       self.sectors, self.industry_groups, self.industries, \
-                       self.countries, self.states, self.market_caps
-
-            # Skip the update if no relevant trigger has occurred
-            if ctx.triggered_id is None or ctx.triggered_id == self.ADD_TRACE_ID or \
-                    (ctx.triggered_id == self.START_DATE_ID and start_date is None) or \
-                    (ctx.triggered_id == self.SECURITIES_DROPDOWN_ID and dropdown_symbol is None):
-                return self.plot, '', self.dropdown_symbol, self.dropdown_options, self.latex_equation, 1, 1, 1, \
-                       [{'label': sector, 'value': sector} for sector in self.sectors], \
-                       [{'label': group, 'value': group} for group in self.industry_groups], \
-                       [{'label': industry, 'value': industry} for industry in self.industries], \
-                       [{'label': country, 'value': country} for country in self.countries], \
-                       [{'label': state, 'value': state} for state in self.states], \
-                       [{'label': market_cap, 'value': market_cap} for market_cap in self.market_caps], \
-                       self.sectors, self.industry_groups, self.industries, \
-                       self.countries, self.states, self.market_caps
+                return build_response()
+
+            # Flipping the add-trace switch only changes how the next input is used, nothing shown changes
+            if triggered_id == self.ADD_TRACE_ID:
+                raise PreventUpdate
+
+            # Skip the update if no relevant trigger has occurred, None is the initial call
+            if triggered_id is None or \
+                    (triggered_id == self.START_DATE_ID and start_date is None) or \
+                    (triggered_id == self.SECURITIES_DROPDOWN_ID and dropdown_symbol is None):
+                return build_response()
 
             # Is the current plot simply being modified or should a whole new plot be loaded
             loading_new_plot = False if dropdown_symbol == self.main_security.symbol else True
 
             # Does plot need to be computed from scratch
             recompute_plot = False
-            if ctx.triggered_id == self.SECURITIES_DROPDOWN_ID:
-                if (dropdown_source == self.FREDMD_SOURCE and f"{dropdown_symbol}_fred" not in
-                    self.all_available_securities) or \
-                        (dropdown_source == self.FREDAPI_SOURCE and f"{dropdown_symbol}_fredapi" not in
-                         self.all_available_securities) or \
-                        (dropdown_source == self.FREDAPIOG_SOURCE and f"{dropdown_symbol}_fredapi_og" not in
-                         self.all_available_securities):
-                    logger.debug(f"SOURCE: {dropdown_source},\n SYMBOL: {dropdown_symbol},\n AVAILABLE SECURITIES: "
-                                 f"{self.all_available_securities}, \nComputing new plot...")
+            if triggered_id == self.SECURITIES_DROPDOWN_ID and dropdown_source in self.FRED_SOURCES:
+                if f"{dropdown_symbol}{SOURCE_FILE_SUFFIXES[dropdown_source]}" not in self._all_available_set:
+                    logger.debug("SOURCE: %s,\n SYMBOL: %s,\n AVAILABLE SECURITIES: %s, \nComputing new plot...",
+                                 dropdown_source, dropdown_symbol, self.all_available_securities)
                     recompute_plot = True
 
-            if input_symbol or (n_clicks is not None and ctx.triggered_id == self.LOAD_PLOT_BUTTON_ID) or \
+            if input_symbol or (n_clicks is not None and triggered_id == self.LOAD_PLOT_BUTTON_ID) or \
                     len(self.main_security.positive_correlations[self.start_date]) == 0:  # Can remove and use ctx id
-                logger.debug(f"{dropdown_source}, \n{dropdown_symbol}, \n{self.all_available_securities}, n_clicks: "
-                             f"{n_clicks}")
+                logger.debug("%s, \n%s, \n%s, n_clicks: %s", dropdown_source, dropdown_symbol,
+                             self.all_available_securities, n_clicks)
                 recompute_plot = True
 
             # New dropdown security's pkl file exists, but selected year is not yet created
             security_exists_but_year_doesnt = False
-            if not recompute_plot and loading_new_plot and dropdown_symbol in self.all_available_securities:
-                test_security = load_saved_securities(dropdown_symbol, self.dropdown_source)
-                if len(test_security.positive_correlations[self.start_date]) == 0:
+            if not recompute_plot and loading_new_plot and dropdown_symbol in self._all_available_set:
+                saved_years = get_saved_correlation_years(dropdown_symbol, self.dropdown_source)
+                if self.start_date not in saved_years:
                     security_exists_but_year_doesnt = True
-                    logger.debug(len(test_security.positive_correlations[start_date]))
-                    for key, value in test_security.positive_correlations.items():
-                        logger.debug(f"{key}, {value[:2]}")
+                    logger.debug("%s saved years: %s", dropdown_symbol, saved_years)
 
             if input_symbol and add_trace:  # Keeping plot, adding trace to it
                 trace_series: pd.Series = read_series_data(input_symbol, 'yahoo')
@@ -744,28 +843,23 @@ class SecurityDashboard:
                 if self.monthly_resample:
                     trace_series = trace_series.resample('MS').first()
                 if self.show_detrended:
-                    trace_series = trace_series.diff().dropna()
-                trace_series_detrended: pd.DataFrame = original_get_validated_security_data(
-                    input_symbol, self.start_date, '2023-06-02', 'yahoo', False, False)
-                correlation = get_correlation_for_series(self.main_security.series_data_detrended[self.start_date],
-                                                         trace_series_detrended)
-                self.plot.add_trace(go.Scatter(x=trace_series.index, y=trace_series, mode='lines',
-                                               name=f'{correlation:.3}  {input_symbol}'), row=1, col=1)
-                self.plot.add_trace(go.Scatter(x=trace_series.index, y=trace_series, mode='lines',
-                                               name=f'{correlation:.3}  {input_symbol}'), row=2, col=1)
+                    trace_series = detrend_data(trace_series)
+                correlation = get_added_trace_correlation(input_symbol, self.start_date)
+                self.plot = go.Figure(self.plot)  # Copy, self.plot may also be held by the figure cache
+                trace = go.Scatter(x=trace_series.index, y=trace_series.to_numpy(), mode='lines',
+                                   name=f'{correlation:.3}  {input_symbol}')
+                self.plot.add_trace(trace, row=1, col=1)  # Same trace on both rows, add_trace copies it
+                self.plot.add_trace(trace, row=2, col=1)
                 save_plot(input_symbol, self.plot)
-                return self.plot, '', self.dropdown_symbol, self.dropdown_options, self.latex_equation, 1, 1, 1, \
-                       [{'label': sector, 'value': sector} for sector in self.sectors], \
-                       [{'label': group, 'value': group} for group in self.industry_groups], \
-                       [{'label': industry, 'value': industry} for industry in self.industries], \
-                       [{'label': country, 'value': country} for country in self.countries], \
-                       [{'label': state, 'value': state} for state in self.states], \
-                       [{'label': market_cap, 'value': market_cap} for market_cap in self.market_caps], \
-                       self.sectors, self.industry_groups, self.industries, \
-                       self.countries, self.states, self.market_caps
+
+                # The browser already has the rest of the figure, so only send it the traces that were just added
+                figure_patch = Patch()
+                for added_trace in self.plot.data[-2:]:
+                    figure_patch['data'].append(added_trace.to_plotly_json())
+                return build_response(figure=figure_patch)
 
             if recompute_plot or security_exists_but_year_doesnt:
-                logger.debug(f"Load {recompute_plot}, {security_exists_but_year_doesnt}")
+                logger.debug("Load %s, %s", recompute_plot, security_exists_but_year_doesnt)
                 # 4 Cases where we recompute: 1. Pressing "Reload" with no other buttons to recalculate a plot
                 # 2. Manually input a symbol to plot 3. Selecting FRED plot from dropdown that hasn't been calculated
                 # 4. Selecting a year that hasn't been calculated yet
@@ -776,7 +870,7 @@ class SecurityDashboard:
                 else:
                     param_symbol = self.main_security.symbol
 
-                if ctx.triggered_id != self.START_DATE_ID:
+                if triggered_id != self.START_DATE_ID:
                     pass
                 elif isinstance(self.main_security, Security):
                     self.dropdown_source = self.SECURITIES_SOURCE
@@ -815,25 +909,27 @@ class SecurityDashboard:
                 )
                 self.main_security = load_saved_securities(param_symbol, self.dropdown_source)
 
-                logger.debug(len(self.main_security.positive_correlations[start_date]))
-                for key, value in self.main_security.positive_correlations.items():
-                    logger.debug(key, value[:2])
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(len(self.main_security.positive_correlations[start_date]))
+                    for key, value in self.main_security.positive_correlations.items():
+                        logger.debug("%s, %s", key, value[:2])
 
-                # Once self.main_security is updated, then we can call update_filter_options
-                update_filter_options()
-                if dropdown_source == self.SECURITIES_SOURCE and param_symbol not in self.available_securities:
+                # Once self.main_security is updated, the filter options can be updated when the response is built
+                self._filter_options_dirty = True
+                if dropdown_source == self.SECURITIES_SOURCE and param_symbol not in self._available_set:
                     self.available_securities.append(param_symbol)
+                    self._available_set.add(param_symbol)
                     self.all_available_securities.append(param_symbol)
-                    self.dropdown_options = self.available_securities
-                elif dropdown_source == self.FREDMD_SOURCE and param_symbol not in self.fredmd_metrics:
-                    self.all_available_securities.append(f'{param_symbol}_fred')
-                    self.dropdown_options = self.fredmd_metrics
-                elif dropdown_source == self.FREDAPI_SOURCE and param_symbol not in self.fred_api_metrics:
-                    self.all_available_securities.append(f'{param_symbol}_fredapi')
-                    self.dropdown_options = self.fred_api_metrics
-                elif dropdown_source == self.FREDAPIOG_SOURCE and param_symbol not in self.fred_api_unrevised_metrics:
-                    self.all_available_securities.append(f'{param_symbol}_fredapi_og')
-                    self.dropdown_options = self.fred_api_unrevised_metrics
+                    self._all_available_set.add(param_symbol)
+                    self.dropdown_options = self.get_source_options(dropdown_source)
+                elif dropdown_source in self.FRED_SOURCES:
+                    # FRED plots are saved under a suffixed name, which is what the recompute check above looks up
+                    saved_name = f'{param_symbol}{SOURCE_FILE_SUFFIXES[dropdown_source]}'
+                    if saved_name not in self._all_available_set:
+                        self.all_available_securities.append(saved_name)
+                        self._all_available_set.add(saved_name)
+                    if param_symbol not in self._source_symbols[dropdown_source][1]:
+                        self.dropdown_options = self.get_source_options(dropdown_source)
 
                 self.dropdown_symbol = param_symbol
                 self.plot = fig_list[0]
@@ -842,35 +938,25 @@ class SecurityDashboard:
                 self.stock = True
                 self.index = True
 
-                if self.dropdown_source == self.FREDMD_SOURCE or self.dropdown_source == self.FREDAPI_SOURCE or \
-                        self.dropdown_source == self.FREDAPIOG_SOURCE:
+                if self.dropdown_source in self.FRED_SOURCES:
                     self.latex_equation = self.main_security.latex_equation
                 else:
                     self.latex_equation = ''
 
                 # Return newly calculated correlation and its plot
-                return self.plot, '', self.dropdown_symbol, self.dropdown_options, self.latex_equation, 1, 1, 1, \
-                       [{'label': sector, 'value': sector} for sector in self.sectors], \
-                       [{'label': group, 'value': group} for group in self.industry_groups], \
-                       [{'label': industry, 'value': industry} for industry in self.industries], \
-                       [{'label': country, 'value': country} for country in self.countries], \
-                       [{'label': state, 'value': state} for state in self.states], \
-                       [{'label': market_cap, 'value': market_cap} for market_cap in self.market_caps], \
-                       self.sectors, self.industry_groups, self.industries, \
-                       self.countries, self.states, self.market_caps
-
-            logger.debug(f'{dropdown_symbol} != {self.main_security.symbol} is {loading_new_plot}')
-            if ctx.triggered_id == self.SECURITIES_DROPDOWN_ID:
-                logger.info(f'New main_security: {dropdown_symbol}')
+                return build_response()
+
+            logger.debug("%s != %s is %s", dropdown_symbol, self.main_security.symbol, loading_new_plot)
+            if triggered_id == self.SECURITIES_DROPDOWN_ID:
+                logger.info("New main_security: %s", dropdown_symbol)
                 self.main_security = load_saved_securities(dropdown_symbol, self.dropdown_source)
 
             if loading_new_plot:
-                logger.debug(f"Loading new plot, dropdown: {dropdown_symbol},"
-                             f" self.main.symbol {self.main_security.symbol}")
+                logger.debug("Loading new plot, dropdown: %s, self.main.symbol %s", dropdown_symbol,
+                             self.main_security.symbol)
                 # If loading a security from disk, make filter options and values set to the new security's options
-                update_filter_options()
-                fig = self.plotter.plot_security_correlations(
-                    main_security=self.main_security,
+                self._filter_options_dirty = True
+                fig = plot_main_security(
                     start_date=self.start_date,
                     num_traces=self.num_traces,
                     display_plot=False,
@@ -890,36 +976,25 @@ class SecurityDashboard:
                 self.stock = True
                 self.index = True
 
-                if (self.dropdown_source == self.FREDMD_SOURCE or self.dropdown_source == self.FREDAPI_SOURCE or
-                    self.dropdown_source == self.FREDAPIOG_SOURCE) and not isinstance(self.main_security, Security):
-                    logger.debug(f"{isinstance(self.main_security, Security)}, type: {type(self.main_security)}")
+                if self.dropdown_source in self.FRED_SOURCES and not isinstance(self.main_security, Security):
+                    logger.debug("%s, type: %s", isinstance(self.main_security, Security), type(self.main_security))
                     self.latex_equation = self.main_security.latex_equation
                 else:
                     self.latex_equation = ''
 
                 # Return the fig to be displayed, tha blank value for the input box, and the value for the dropdown
-                return self.plot, '', self.dropdown_symbol, self.dropdown_options, self.latex_equation, 1, 1, 1, \
-                       [{'label': sector, 'value': sector} for sector in self.sectors], \
-                       [{'label': group, 'value': group} for group in self.industry_groups], \
-                       [{'label': industry, 'value': industry} for industry in self.industries], \
-                       [{'label': country, 'value': country} for country in self.countries], \
-                       [{'label': state, 'value': state} for state in self.states], \
-                       [{'label': market_cap, 'value': market_cap} for market_cap in self.market_caps], \
-                       self.sectors, self.industry_groups, self.industries, \
-                       self.countries, self.states, self.market_caps
+                return build_response()
 
             else:  # Modifying current plot, Not loading a new plot
-                logger.debug(f"Keeping current plot, dropdown:, {dropdown_symbol}, self.main.symbol:, "
-                             f"{self.main_security.symbol}")
+                logger.debug("Keeping current plot, dropdown:, %s, self.main.symbol:, %s", dropdown_symbol,
+                             self.main_security.symbol)
                 # Create a list of correlations to be displayed based on selected options
                 filter_displayed_correlations(self.start_date, self.num_traces, self.etf, self.stock, self.index,
                                               selected_sectors, selected_industry_groups, self.industries,
                                               selected_countries, selected_states, selected_market_caps,
-                                              self.otc_filter, ctx)
+                                              self.otc_filter, triggered_id)
                 # Update the filter options based on new num_traces
-                if ctx.triggered_id == self.NUM_TRACES_ID or ctx.triggered_id == self.SOURCE_ETF_ID \
-                        or ctx.triggered_id == self.SOURCE_STOCK_ID or ctx.triggered_id == self.SOURCE_INDEX_ID \
-                        or ctx.triggered_id == self.START_DATE_ID:
+                if triggered_id in self.FILTER_RESET_TRIGGER_IDS:
                     logger.debug("UPDATING FILTER OPTIONS")
                     update_filter_options()
                     selected_sectors = self.sectors
@@ -930,8 +1005,7 @@ class SecurityDashboard:
                     selected_market_caps = self.market_caps
 
                 # Modify current plot
-                fig = self.plotter.plot_security_correlations(
-                    main_security=self.main_security,
+                fig = plot_main_security(
                     start_date=start_date,
                     num_traces=num_traces,
                     display_plot=False,
@@ -955,126 +1029,249 @@ class SecurityDashboard:
                     displayed_negative_correlations=self.displayed_negatively_correlated,
                 )
 
+                # Same cached figure as the one already shown, e.g. a filter change that kept the same traces
+                figure_unchanged = fig is self.plot
                 self.plot = fig
 
                 # Return the fig to be displayed, the blank value for the input box, and the value for the dropdown
-                return self.plot, '', self.dropdown_symbol, self.dropdown_options, self.latex_equation, \
-                       etf_clicks, stock_clicks, index_clicks, \
-                       [{'label': sector, 'value': sector} for sector in self.sectors], \
-                       [{'label': group, 'value': group} for group in self.industry_groups], \
-                       [{'label': industry, 'value': industry} for industry in self.industries], \
-                       [{'label': country, 'value': country} for country in self.countries], \
-                       [{'label': state, 'value': state} for state in self.states], \
-                       [{'label': market_cap, 'value': market_cap} for market_cap in self.market_caps], \
-                       selected_sectors, selected_industry_groups, selected_industries, \
-                       selected_countries, selected_states, selected_market_caps
+                return build_response((etf_clicks, stock_clicks, index_clicks),
+                                      (selected_sectors, selected_industry_groups, selected_industries,
+                                       selected_countries, selected_states, selected_market_caps),
+                                      figure=dash.no_update if figure_unchanged else None)
+
+        def build_response(source_clicks=(1, 1, 1), selected_filter_values=None, figure=None):
+            """Builds the update_graph return tuple, first updating the filter options if they were marked dirty.
+            figure defaults to self.plot, but can be a Patch when only part of the figure changed, or dash.no_update"""
+            if self._filter_options_dirty:
+                update_filter_options()
+            if selected_filter_values is None:
+                selected_filter_values = self.get_filter_values()
+            if figure is None:  # Send the already converted JSON dict when self.plot came from the figure cache
+                figure = self._plot_json[1] if self._plot_json and self._plot_json[0] is self.plot else self.plot
+
+            return (figure, '', self.dropdown_symbol, self.dropdown_options,
+                    self.latex_equation, *source_clicks,
+                    *self._filter_options, *selected_filter_values)
+
+        def plot_main_security(**plot_kwargs) -> go.Figure:
+            """Plots main_security, reusing the figure of an identical recent plot instead of rebuilding it"""
+            displayed_positive = plot_kwargs.get('displayed_positive_correlations')
+            displayed_negative = plot_kwargs.get('displayed_negative_correlations')
+            key = (id(self.main_security), plot_kwargs['start_date'], plot_kwargs['num_traces'],
+                   bool(plot_kwargs['show_detrended']), bool(plot_kwargs['monthly']),
+                   None if displayed_positive is None else tuple(security.symbol for security in displayed_positive),
+                   None if displayed_negative is None else tuple(security.symbol for security in displayed_negative))
+
+            cached = self._figure_cache.get(key)
+            if cached is not None and cached[0] is self.main_security:  # Entry keeps the object so its id isn't reused
+                self._figure_cache.move_to_end(key)
+            else:
+                fig = self.plotter.plot_security_correlations(main_security=self.main_security, **plot_kwargs)
+                cached = (self.main_security, fig, fig.to_plotly_json())
+                self._figure_cache[key] = cached
+                if len(self._figure_cache) > self.FIGURE_CACHE_SIZE:
+                    self._figure_cache.popitem(last=False)
+
+            self._plot_json = cached[1:]
+            return cached[1]
 
         def update_filter_options():
-            self.sectors = self.main_security.get_unique_values('sector', self.start_date)
+            self._filter_options_dirty = False
+
+            # Memoized per main_security object and start date. The entry keeps the object alive so its id isn't reused
+            key = (id(self.main_security), self.start_date)
+            cached = self._filter_options_cache.get(key)
+            if cached is not None and cached[0] is self.main_security:
+                self.sectors, self.industry_groups, self.industries, self.countries, self.states, \
+                    self.market_caps = cached[1]
+                self._filter_options = cached[2]
+                return
+
+            unique_values = self.main_security.get_all_unique_values(self.FILTER_ATTRIBUTES, self.start_date)
+            previous_values = self.get_filter_values()
+            filter_values, filter_options = [], []
+            for attribute, old_values, old_options in zip(self.FILTER_ATTRIBUTES, previous_values,
+                                                          self._filter_options):
+                values = unique_values[attribute]
+                if len(values) == len(old_values) and set(values) == set(old_values):
+                    values, options = old_values, old_options  # Same choices as before, reuse the built options
+                else:
+                    options = self.to_dropdown_options(values)
+                filter_values.append(values)
+                filter_options.append(options)
+            self.sectors, self.industry_groups, self.industries, self.countries, self.states, \
+                self.market_caps = filter_values
+            self._filter_options = tuple(filter_options)
 
-            logger.debug(f"\nSectors: \n {self.sectors}")
-            for security in self.displayed_positively_correlated:
-                logger.debug(f'Symbol: {security.symbol}, Source: {security.source}, Sector: {security.sector}')
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("\nSectors: \n %s", self.sectors)
+                for security in self.displayed_positively_correlated:
+                    logger.debug("Symbol: %s, Source: %s, Sector: %s", security.symbol, security.source,
+                                 security.sector)
 
-            logger.debug("Options for sector dropdown:\n",
-                         [{'label': sector, 'value': sector} for sector in self.sectors])
+                logger.debug("Options for sector dropdown:\n%s", self._filter_options[0])
 
-            self.industry_groups = self.main_security.get_unique_values('industry_group', self.start_date)
-            self.industries = self.main_security.get_unique_values('industry', self.start_date)
-            self.countries = self.main_security.get_unique_values('country', self.start_date)
-            self.states = self.main_security.get_unique_values('state', self.start_date)
-            self.market_caps = self.main_security.get_unique_values('market_cap', self.start_date)
+            if len(self._filter_options_cache) >= 128:
+                self._filter_options_cache.clear()
+            self._filter_options_cache[key] = (self.main_security, self.get_filter_values(), self._filter_options)
 
         def filter_displayed_correlations(start_date, num_traces: int,
                                           etf: bool, stock: bool,
                                           index: bool, sector: List[str],
                                           industry_group: List[str], industry: List[str],
                                           country: List[str], state: List[str],
-                                          market_cap: List[str], otc_filter: bool, ctx):
+                                          market_cap: List[str], otc_filter: bool, triggered_id: Optional[str]):
             """Updates the displayed correlation sets"""
 
-            args_dict = locals().copy()
-            args_dict.pop('self')  # Remove 'self' from the dictionary
+            if self._debug_dump:
+                args_dict = locals().copy()
+                args_dict.pop('self')  # Remove 'self' from the dictionary
 
-            with open('ui/debug_file.txt', 'a') as f:
-                f.write('\n')
+                with open('ui/debug_file.txt', 'a') as f:
+                    f.write('\n')
 
-            with open('ui/debug_file2.txt', 'a') as f:
-                for key, value in args_dict.items():
-                    f.write(f'{key}: {value}\n')
+                with open('ui/debug_file2.txt', 'a') as f:
+                    for key, value in args_dict.items():
+                        f.write(f'{key}: {value}\n')
 
-            self.displayed_positively_correlated.clear()
-            self.displayed_negatively_correlated.clear()
+            # Metadata filters only apply to stocks, and not when the plot is being changed by one of these inputs
+            apply_metadata_filters = triggered_id not in self.SKIP_METADATA_FILTER_TRIGGER_IDS
+            metadata_filters = (('sector', sector), ('industry_group', industry_group), ('industry', industry),
+                                ('country', country), ('state', state), ('market_cap', market_cap))
 
             correlation_list = [self.main_security.positive_correlations, self.main_security.negative_correlations]
             displayed_correlation_list = [self.displayed_positively_correlated, self.displayed_negatively_correlated]
 
-            for correlation_set, displayed_set in zip(correlation_list, displayed_correlation_list):
-                added_count = 0
-                for security in correlation_set[start_date]:
-                    if added_count >= num_traces:
-                        break
-
-                    if security.source == 'etf' and not etf:
-                        continue
-                    elif security.source == 'stock' and not stock:
-                        continue
-                    elif security.source == 'index' and not index:
-                        continue
-
-                    if security.source == 'stock' and ctx.triggered_id != self.SOURCE_STOCK_ID and ctx.triggered_id != \
-                            self.SOURCE_ETF_ID and ctx.triggered_id != self.SOURCE_INDEX_ID \
-                            and ctx.triggered_id != self.START_DATE_ID and ctx.triggered_id != \
-                            self.SECURITIES_DROPDOWN_ID \
-                            and ctx.triggered_id != self.NUM_TRACES_ID:
-                        if sector is not None and security.sector not in sector:
-                            continue
-                        if industry_group is not None and security.industry_group not in industry_group:
-                            continue
-                        if industry is not None and security.industry not in industry:
-                            continue
-                        if country is not None and security.country not in country:
-                            continue
-                        if state is not None and security.state not in state:
-                            continue
-                        if market_cap is not None and security.market_cap not in market_cap:
-                            continue
-
-                        if otc_filter and 'OTC ' in security.market:  # If otc_filter and market contains 'OTC ' skip
-                            continue
-
-                    displayed_set.append(security)
-                    logger.debug(security)
-
-                    added_count += 1
+            hidden_sources = [source for source, shown in (('etf', etf), ('stock', stock), ('index', index))
+                              if not shown]
+
+            for correlation_set, columns, displayed_set in zip(correlation_list, get_correlation_columns(start_date),
+                                                               displayed_correlation_list):
+                # Each attribute is integer coded, so a filter is a lookup table over the (few) unique values indexed
+                # by the codes. The kernel walks the rows once and stops after num_traces matches
+                source_codes, source_uniques = columns['source']
+                attribute_allowed = np.ones((len(metadata_filters), columns['max_uniques']), dtype=bool)
+                for row, (attribute_name, selected_values) in enumerate(metadata_filters):
+                    if selected_values is not None:
+                        uniques = columns[attribute_name][1]
+                        attribute_allowed[row, :uniques.size] = np.isin(uniques, selected_values)
+
+                # Same count as adding matches until num_traces is reached: none for a negative or empty num_traces,
+                # and a fractional one rounds up
+                limit = max(math.ceil(num_traces or 0), 0)
+                selected = select_filtered_indices(source_codes, ~np.isin(source_uniques, hidden_sources),
+                                                   source_uniques == 'stock', columns['attribute_codes'],
+                                                   attribute_allowed, columns['is_otc'], apply_metadata_filters,
+                                                   bool(otc_filter), limit)
+
+                # Refill the list in place with one slice assignment, it's shared with the plotter and its length is
+                # set once instead of growing one append at a time
+                securities = correlation_set[start_date]
+                displayed_set[:] = [securities[i] for i in selected.tolist()]
+                if logger.isEnabledFor(logging.DEBUG):
+                    for security in displayed_set:
+                        logger.debug(security)
+
+        def build_correlation_columns(raw_columns: Dict[str, np.ndarray]) -> Dict[str, Any]:
+            """Filterable form of one correlation list's columns for select_filtered_indices"""
+            columns: Dict[str, Any] = {}
+            for attribute_name in ('source', *self.FILTER_ATTRIBUTES):
+                values = raw_columns[attribute_name].copy()
+                # Missing values become '', which never matches a selected (always non-empty) filter value
+                values[~values.astype(bool)] = ''
+                columns[attribute_name] = pd.factorize(values)
+            columns['is_otc'] = raw_columns['is_otc'].astype(bool)
+            # Codes of the metadata filters stacked in FILTER_ATTRIBUTES order, one row per attribute
+            columns['attribute_codes'] = np.vstack([columns[attribute_name][0].astype(np.int64)
+                                                    for attribute_name in self.FILTER_ATTRIBUTES])
+            columns['max_uniques'] = max(columns[attribute_name][1].size for attribute_name in self.FILTER_ATTRIBUTES)
+            return columns
+
+        def get_correlation_columns(start_date) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+            """Returns the filterable attributes of main_security's positive and negative correlations as
+            (int codes, unique values) pairs from pd.factorize, built once per main_security and start date"""
+            sync_main_security_caches()
+            if start_date not in self._correlation_columns:
+                self._correlation_columns[start_date] = tuple(
+                    build_correlation_columns(raw_columns)
+                    for raw_columns in self.main_security.get_correlation_columns(
+                        ('source', *self.FILTER_ATTRIBUTES, 'is_otc'), start_date)
+                )
+
+            return self._correlation_columns[start_date]
+
+        def get_main_detrended_array(start_date) -> Tuple[pd.DatetimeIndex, np.ndarray, float]:
+            """Returns main_security's detrended index, its mean-centered values as a contiguous float32 array, and the
+            L2 norm of those values"""
+            sync_main_security_caches()
+            if start_date not in self._main_detrended_arrays:
+                detrended: pd.Series = self.main_security.series_data_detrended[start_date]['main']
+                values = np.ascontiguousarray(detrended.to_numpy(), dtype=np.float32)
+                centered = values - values.mean()
+                self._main_detrended_arrays[start_date] = (detrended.index, centered, float(np.linalg.norm(centered)))
+
+            return self._main_detrended_arrays[start_date]
+
+        def get_added_trace_correlation(symbol: str, start_date: str) -> float:
+            """Pearson correlation of an added trace against main_security, computed as a single dot product"""
+            sync_main_security_caches()
+            key = (symbol, start_date)
+            if key not in self._added_trace_correlations:
+                main_index, main_centered, main_norm = get_main_detrended_array(start_date)
+                trace_detrended: pd.Series = original_get_validated_security_data(
+                    symbol, start_date, '2023-06-02', 'yahoo', False, False)['symbol']
+
+                # Inner join on dates, main values only need re-centering if they don't fully overlap
+                positions = main_index.get_indexer(trace_detrended.index)
+                matched = positions >= 0
+                main_values = main_centered
+                if np.count_nonzero(matched) != main_centered.size:
+                    main_values = main_centered[positions[matched]]
+                    main_values = main_values - main_values.mean()
+                    main_norm = np.linalg.norm(main_values)
+
+                trace_values = np.ascontiguousarray(trace_detrended.to_numpy()[matched], dtype=np.float32)
+                trace_values = trace_values - trace_values.mean()
+                self._added_trace_correlations[key] = \
+                    float(np.dot(main_values, trace_values) / (main_norm * np.linalg.norm(trace_values)))
+
+            return self._added_trace_correlations[key]
+
+        def sync_main_security_caches():
+            """Clears the values cached from main_security if it has been replaced since they were computed"""
+            if self._main_security_cache_owner is not self.main_security:
+                self._main_security_cache_owner = self.main_security
+                self._correlation_columns = {}
+                self._main_detrended_arrays = {}
+                self._added_trace_correlations = {}
 
         def check_changes(dropdown_symbol, dropdown_source, add_trace, start_date, num_traces, etf_clicks,
                           stock_clicks, index_clicks, detrend_plot, monthly, otc_filter):
-            comparisons = [
-                ('dropdown_symbol', self.dropdown_symbol, dropdown_symbol),
-                ('dropdown_source', self.dropdown_source, dropdown_source),
-                ('add_trace', self.add_trace, add_trace),
-                ('start_date', self.start_date, start_date),
-                ('num_traces', self.num_traces, num_traces),
-                ('etf', self.etf, etf_clicks % 2 == 1),
-                ('stock', self.stock, stock_clicks % 2 == 1),
-                ('index', self.index, index_clicks % 2 == 1),
-                ('show_detrended', self.show_detrended, detrend_plot),
-                ('monthly_resample', self.monthly_resample, monthly),
-                ('otc_filter', self.otc_filter, otc_filter)
-            ]
-
-            no_changes_have_been_made = True
-
-            for name, self_val, val in comparisons:
-                if self_val != val:
-                    logger.debug(f"self.{name}: {self_val} != {name}: {val}")
-                    no_changes_have_been_made = False
-
-            return no_changes_have_been_made
+            """Returns True if no value differs from the current state, stopping at (and logging) the first change"""
+            states = (('dropdown_symbol', self.dropdown_symbol, dropdown_symbol),
+                      ('dropdown_source', self.dropdown_source, dropdown_source),
+                      ('add_trace', self.add_trace, add_trace),
+                      ('start_date', self.start_date, start_date),
+                      ('num_traces', self.num_traces, num_traces),
+                      ('etf', self.etf, etf_clicks % 2 == 1),
+                      ('stock', self.stock, stock_clicks % 2 == 1),
+                      ('index', self.index, index_clicks % 2 == 1),
+                      ('show_detrended', self.show_detrended, detrend_plot),
+                      ('monthly_resample', self.monthly_resample, monthly),
+                      ('otc_filter', self.otc_filter, otc_filter))
+            for name, current, new in states:
+                if current != new:
+                    logger.debug("self.%s: %s != %s: %s", name, current, name, new)
+                    return False
+
+            return True
 
     def run(self):
-        self.app.run_server(debug=False, host='localhost', port=int(os.environ.get('PORT', 8080)))
+        # Dev tools (props check, hot reload, error UI) validate every callback output, only enable them on request
+        dev_mode = os.environ.get('SECCORR_DEV') == '1'
+        self.app.run_server(debug=dev_mode, dev_tools_props_check=dev_mode, dev_tools_hot_reload=dev_mode,
+                            dev_tools_ui=dev_mode, dev_tools_serve_dev_bundles=dev_mode,
+                            host='localhost', port=int(os.environ.get('PORT', 8080)))
 
 
 if __name__ == '__main__':
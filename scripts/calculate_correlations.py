@@ -1,13 +1,22 @@
+import copy
 import logging
 from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from multiprocessing import Pool, cpu_count
-from typing import List, Union, Set
+from typing import Dict, List, Optional, Set, Tuple, Union
 import warnings
 
+import numpy as np
 import pandas as pd
 
 from scripts.correlation_constants import Security, FredapiSeries, FredmdSeries, start_years
-from scripts.file_reading_funcs import original_get_validated_security_data
+from scripts.file_reading_funcs import original_get_validated_security_data, preload_series_data, \
+    clear_preloaded_series_data
+
+PRELOAD_CHUNK_SIZE = 512  # Symbols read per dataset scan, bounds how many raw series are held at once
+
+# Arguments original_get_validated_security_data has returned data for, its memo is unbounded so they stay memoized
+validated_keys: Set[tuple] = set()
 
 warnings.filterwarnings("ignore")
 
@@ -32,10 +41,93 @@ def get_correlation_for_series(main_security_data_detrended: pd.DataFrame,
     return correlation
 
 
+def align_candidates(main_index: pd.Index, candidates_data_detrended: Dict[str, pd.DataFrame]) \
+        -> Tuple[List[str], List[str], Optional[np.ndarray]]:
+    """Splits the candidates by whether they have a value on every date of main_index. Those that do are stacked into
+    one matrix, each row zero-meaned and scaled to unit length, the rest need the pairwise inner-join correlation.
+    Returns (pairwise symbols, stacked symbols, matrix). Only depends on the main series' dates, so main series with
+    the same dates can share it"""
+    pairwise_symbols = []
+    stacked_symbols = []
+    stacked_rows = []
+    for symbol, security_data_detrended in candidates_data_detrended.items():
+        aligned: pd.Series = security_data_detrended['symbol'].reindex(main_index)
+        if aligned.isna().any():
+            pairwise_symbols.append(symbol)
+        else:
+            stacked_symbols.append(symbol)
+            stacked_rows.append(aligned.to_numpy(dtype=np.float32))
+
+    matrix = None
+    if stacked_rows:
+        # Zero-mean and scale each row to unit length once, so each correlation is a single dot product
+        matrix = np.vstack(stacked_rows)
+        matrix -= matrix.mean(axis=1, keepdims=True)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+
+    return pairwise_symbols, stacked_symbols, matrix
+
+
+def get_correlations_for_candidates(main_security_data_detrended: pd.DataFrame,
+                                    candidates_data_detrended: Dict[str, pd.DataFrame],
+                                    aligned_candidates: Optional[Tuple[List[str], List[str], Optional[np.ndarray]]]
+                                    = None) -> Dict[str, float]:
+    """Correlates the main series against every candidate at once. Candidates with a value on every date of the main
+    series are correlated with a single matrix-vector product, the rest fall back to the pairwise inner-join
+    correlation. aligned_candidates, from align_candidates for the main series' dates, is built if not given"""
+    main_series: pd.Series = main_security_data_detrended['main']
+    if aligned_candidates is None:
+        aligned_candidates = align_candidates(main_series.index, candidates_data_detrended)
+    pairwise_symbols, stacked_symbols, matrix = aligned_candidates
+
+    correlations: Dict[str, float] = {
+        symbol: get_correlation_for_series(main_security_data_detrended, candidates_data_detrended[symbol])
+        for symbol in pairwise_symbols
+    }
+
+    if matrix is not None:
+        main_values = main_series.to_numpy(dtype=np.float32)
+        main_values = main_values - main_values.mean()
+        main_values /= np.linalg.norm(main_values)
+
+        correlations.update(zip(stacked_symbols, (matrix @ main_values).tolist()))
+
+    return correlations
+
+
+def smallest_indices(values: np.ndarray, count: int) -> np.ndarray:
+    """Indices of the count smallest values in ascending order, the same as sorted(...)[:count] over them: ties keep
+    their original order. Partitions first, so only the values up to the count-th smallest are sorted. NaNs, from
+    candidates without any variance, sort last"""
+    count = min(count, values.size)
+    if count == 0:
+        return np.empty(0, dtype=np.intp)
+    threshold = np.partition(values, count - 1)[count - 1]
+    # Everything up to the threshold, ties included so the stable sort picks the first of them. A NaN threshold
+    # means there are fewer than count numbers, so all values are candidates
+    candidates = np.arange(values.size) if np.isnan(threshold) else np.flatnonzero(values <= threshold)
+    return candidates[np.argsort(values[candidates], kind='stable')[:count]]
+
+
+@lru_cache(maxsize=4096)
+def get_correlated_security_template(symbol: str) -> Security:
+    """A Security with only its metadata set, shared across calculations so a symbol that shows up in the top
+    correlations again isn't looked up in the metadata again. Never modified, only shallow copied"""
+    return Security(symbol)
+
+
 def define_top_correlations(all_main_securities: List[Security | FredmdSeries | FredapiSeries]) \
         -> List[Security | FredmdSeries | FredapiSeries]:
     num_symbols = 100
 
+    # A symbol is usually among the top correlations of several years, lists and main securities. Its metadata is
+    # looked up once, each appearance is a shallow copy with its own correlation, sharing the template's attributes and
+    # (empty) year dicts
+    def make_correlated_security(symbol: str, correlation: float) -> Security:
+        correlated_security = copy.copy(get_correlated_security_template(symbol))
+        correlated_security.set_correlation(correlation)
+        return correlated_security
+
     # Define the correlation attributes and their corresponding positive and negative correlation attributes
 
     # Loop through each securities_main security
@@ -47,20 +139,21 @@ def define_top_correlations(all_main_securities: List[Security | FredmdSeries |
             if len(correlation_dict) == 0:
                 continue
 
-            # Sort the symbols by their correlation values in descending and ascending order
-            sorted_symbols_desc = sorted(correlation_dict.keys(), key=correlation_dict.get, reverse=True)
-            sorted_symbols_asc = sorted(correlation_dict.keys(), key=correlation_dict.get, reverse=False)
+            # Only the num_symbols most and least correlated are kept, selected from the correlations as one array
+            # rather than by comparing dict entries one at a time
+            symbols = list(correlation_dict)
+            values = np.fromiter(correlation_dict.values(), dtype=np.float64, count=len(symbols))
+            sorted_symbols_desc = [symbols[i] for i in smallest_indices(-values, num_symbols).tolist()]
+            sorted_symbols_asc = [symbols[i] for i in smallest_indices(values, num_symbols).tolist()]
 
             # Add the top num_symbols positively correlated securities to the positive_correlations attribute
-            for symbol in sorted_symbols_desc[:num_symbols]:
-                correlated_security = Security(symbol)
-                correlated_security.set_correlation(correlation_dict[symbol])
+            for symbol in sorted_symbols_desc:
+                correlated_security = make_correlated_security(symbol, correlation_dict[symbol])
                 main_security.positive_correlations[start_date].append(correlated_security)
 
             # Add the top num_symbols negatively correlated securities to the negative_correlations attribute
-            for symbol in sorted_symbols_asc[:num_symbols]:
-                correlated_security = Security(symbol)
-                correlated_security.set_correlation(correlation_dict[symbol])
+            for symbol in sorted_symbols_asc:
+                correlated_security = make_correlated_security(symbol, correlation_dict[symbol])
                 main_security.negative_correlations[start_date].append(correlated_security)
 
             # Set the correlation_dict for the start_date to None
@@ -138,8 +231,8 @@ all_main_securities is generally only a few securities long"""
 
     @staticmethod
     def get_validated_security_data(cache, symbol, start_date, end_date, source, dl_data, use_ch):
-        # Check if data exists in cache
-        data = cache.get(symbol)
+        # Check if data exists in cache, the data is cut to the start date so it's cached per start date
+        data = cache.get((symbol, start_date))
         if data is not None:
             # print(f"Cache hit for {symbol}. Total hits: {cache.get_hits()}, Total misses: {cache.get_misses()}")
             return data
@@ -147,7 +240,7 @@ all_main_securities is generally only a few securities long"""
         # If not in cache, compute the data and store it in the cache
         data = original_get_validated_security_data(symbol, start_date, end_date, source, dl_data, use_ch)
         if data is not None:
-            cache.set(symbol, data)
+            cache.set((symbol, start_date), data)
         # print(f"Cache miss for {symbol}. Total hits: {cache.get_hits()}, Total misses: {cache.get_misses()}")
         return data
 
@@ -159,31 +252,57 @@ all_main_securities is generally only a few securities long"""
         symbols = set(self.symbols)  # This changes the order of symbols
         all_main_securities_set = set(all_main_securities)
 
-        for symbol in symbols:
+        # Load each candidate once, then correlate all of them against each main security in a single batch
+        candidates_data_detrended = {}
+        symbols = list(symbols)
+        preload = source == 'yahoo' and not dl_data and not use_ch  # Only the local parquets can be scanned at once
+        for chunk_start in range(0, len(symbols), PRELOAD_CHUNK_SIZE):
+            chunk = symbols[chunk_start:chunk_start + PRELOAD_CHUNK_SIZE]
+            if preload:  # Symbols whose validated data is already memoized won't read their series again
+                preload_series_data([symbol for symbol in chunk if
+                                     (symbol, start_date, end_date, source, dl_data, use_ch) not in validated_keys])
             try:
-                security_data_detrended = original_get_validated_security_data(symbol, start_date, end_date, source,
-                                                                               dl_data, use_ch)
-            except AttributeError:  # Better than checking if its None every time
+                for symbol in chunk:
+                    key = (symbol, start_date, end_date, source, dl_data, use_ch)
+                    try:
+                        candidates_data_detrended[symbol] = original_get_validated_security_data(*key)
+                    except AttributeError:  # Better than checking if its None every time
+                        continue
+                    validated_keys.add(key)
+            finally:
+                if preload:
+                    clear_preloaded_series_data()  # Drops the series of symbols that weren't read
+
+        # Main series with the same dates share one aligned candidate matrix, so they're grouped by a cheap key of
+        # their dates and only one matrix is held at a time
+        main_securities_by_dates: Dict[tuple, list] = {}
+        for main_security in all_main_securities_set:
+            main_security_data_detrended = main_security.series_data_detrended[start_date]
+            if main_security_data_detrended is None:
+                logger.warning(f'Skipping correlation calculation for {main_security.symbol} due to missing data.')
                 continue
+            dates = main_security_data_detrended.index
+            key = (len(dates), dates[0], dates[-1]) if len(dates) else (0,)
+            main_securities_by_dates.setdefault(key, []).append(main_security)
 
-            for main_security in all_main_securities_set:
-
-                if isinstance(main_security, Security) and symbol == main_security.symbol:
-                    continue  # Skips comparison if being compared to itself
-
+        for main_securities in main_securities_by_dates.values():
+            aligned_dates, aligned_candidates = None, None
+            for main_security in main_securities:
                 main_security_data_detrended = main_security.series_data_detrended[start_date]
+                if aligned_dates is None or not aligned_dates.equals(main_security_data_detrended.index):
+                    aligned_dates = main_security_data_detrended.index
+                    aligned_candidates = align_candidates(aligned_dates, candidates_data_detrended)
+
+                correlations = get_correlations_for_candidates(main_security_data_detrended, candidates_data_detrended,
+                                                               aligned_candidates)
 
-                try:
-                    correlation_float = get_correlation_for_series(main_security_data_detrended,
-                                                                   security_data_detrended)
-                except TypeError:
-                    logger.warning(f'Skipping correlation calculation for {symbol} due to missing data.')
-                    continue
+                if isinstance(main_security, Security):
+                    correlations.pop(main_security.symbol, None)  # Skips comparison if being compared to itself
 
                 if start_date not in main_security.all_correlations:
                     main_security.all_correlations[start_date] = {}
 
-                main_security.all_correlations[start_date][symbol] = correlation_float
+                main_security.all_correlations[start_date].update(correlations)
 
         return all_main_securities
 
@@ -1,6 +1,14 @@
+import atexit
+import os
+import threading
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
 from clickhouse_driver import Client
 
 from config import STOCKS_DIR
@@ -9,39 +17,84 @@ CH_HOST = 'localhost'
 CH_PORT = 9000
 CH_DATABASE = 'stock_data'
 CH_TABLE = 'yfinance'
-BATCH_SIZE = 5000
+FLUSH_ROWS = 500_000  # Rows from several files are collected into one INSERT block of at least this size
 source_dir = STOCKS_DIR / 'yahoo_daily/'
 NUM_PROCESSES = 100  # Adjust this based on your preference
 
-client = Client(host=CH_HOST, port=CH_PORT, database=CH_DATABASE)
+client_local = threading.local()  # One client per thread, a Client's connection can't be shared between threads
 
 
-def insert_data_to_clickhouse(data_tuples):
-    ch_client = Client(host=CH_HOST, port=CH_PORT, database=CH_DATABASE)
-    ch_client.execute("SET max_insert_block_size = 100000")
-    ch_client.execute("SET max_insert_threads = 12")
-    query = f"INSERT INTO {CH_TABLE} FORMAT TabSeparated"
-    ch_client.execute(query, data_tuples)
+INSERT_COLUMNS = ('Date', 'Open', 'High', 'Low', 'Close', 'Adj_Close', 'Volume', 'Ticker')
+CSV_COLUMNS = ('Date', 'Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume')  # The CSV names of INSERT_COLUMNS[:-1]
+# Dates are parsed straight to date32, which converts to the datetime.date values a ClickHouse Date column takes
+CSV_CONVERT_OPTIONS = pv.ConvertOptions(column_types={'Date': pa.date32()}, include_columns=list(CSV_COLUMNS))
+INSERT_SETTINGS = {'max_insert_block_size': 1_000_000, 'max_insert_threads': 12}
+
+
+def get_client() -> Client:
+    """Returns this thread's ClickHouse client, creating it on first use so its connection is reused by every
+    later query and batch in the thread. Nothing connects at import, and a forked process gets its own client rather
+    than sharing the parent's socket"""
+    if getattr(client_local, 'pid', None) != os.getpid():
+        client_local.client = Client(host=CH_HOST, port=CH_PORT, database=CH_DATABASE, settings=INSERT_SETTINGS)
+        client_local.pid = os.getpid()
+    return client_local.client
+
+
+@atexit.register
+def disconnect_client():
+    """Closes the main thread's connection on exit, worker threads' clients are closed when their threads end"""
+    if getattr(client_local, 'pid', None) == os.getpid():
+        client_local.client.disconnect()
+
+
+def insert_data_to_clickhouse(ch_client, data_columns):
+    """Inserts one batch, given as a list of columns in INSERT_COLUMNS order, using the native columnar protocol"""
+    query = f"INSERT INTO {CH_TABLE} ({', '.join(INSERT_COLUMNS)}) VALUES"
+    ch_client.execute(query, data_columns, columnar=True, types_check=False)
+
+
+def to_insert_column(column: pa.ChunkedArray) -> list:
+    """A column's values as Python objects. Nulls in numeric columns become NaN, as they were when the CSVs were read
+    through pandas, since a None can't be packed into a Float64 column without type checks"""
+    if column.null_count and (pa.types.is_integer(column.type) or pa.types.is_floating(column.type)):
+        column = pc.fill_null(column.cast(pa.float64()), float('nan'))
+    return column.to_pylist()
 
 
 def process_csv_file(csv_file):
+    """Reads one CSV as a list of columns in INSERT_COLUMNS order"""
     print(f"Processing {csv_file.name}...")
-    df = pd.read_csv(csv_file)
-    df['Date'] = pd.to_datetime(df['Date']).dt.date
-    # Add the Ticker column
+    # pyarrow's reader tokenizes on multiple threads and skips pandas' dtype inference and date re-parsing
+    table = pv.read_csv(csv_file, convert_options=CSV_CONVERT_OPTIONS)
     ticker = csv_file.stem  # Get the filename without extension
-    df['Ticker'] = ticker
-    df = df.rename(columns={"Adj Close": "Adj_Close"})
-    data_tuples = list(df.itertuples(index=False, name=None))
-
-    # Split data into batches and insert
-    for i in range(0, len(data_tuples), BATCH_SIZE):
-        insert_data_to_clickhouse(data_tuples[i:i + BATCH_SIZE])
+    data_columns = [to_insert_column(table.column(column)) for column in CSV_COLUMNS]
+    data_columns.append([ticker] * table.num_rows)
+    return data_columns
 
 
 def migrate_data_to_clickhouse():
+    """Reads the CSVs in parallel and inserts their rows in blocks of FLUSH_ROWS or more, most files are only a few
+    thousand rows so one INSERT per file would create a MergeTree part for each of them"""
+    block = [[] for _ in INSERT_COLUMNS]
+    csv_files = source_dir.glob("*.csv")
     with ThreadPoolExecutor(max_workers=NUM_PROCESSES) as executor:
-        list(executor.map(process_csv_file, source_dir.glob("*.csv")))
+        # A file is only submitted once an earlier one has been taken, so at most NUM_PROCESSES converted files wait
+        # for the inserting thread instead of every file piling up in completed futures
+        pending = deque(executor.submit(process_csv_file, csv_file) for csv_file in islice(csv_files, NUM_PROCESSES))
+        while pending:
+            data_columns = pending.popleft().result()
+            next_file = next(csv_files, None)
+            if next_file is not None:
+                pending.append(executor.submit(process_csv_file, next_file))
+            for block_column, column in zip(block, data_columns):
+                block_column.extend(column)
+            if len(block[0]) >= FLUSH_ROWS:
+                insert_data_to_clickhouse(get_client(), block)
+                block = [[] for _ in INSERT_COLUMNS]
+
+    if block[0]:  # Remainder of the last block
+        insert_data_to_clickhouse(get_client(), block)
     print("Migration completed!")
 
 
@@ -50,7 +103,7 @@ def migrate_data_to_clickhouse():
 
 
 def example_retrieve_data_from_clickhouse(ticker, save_to_csv=False):
-    client = Client(host=CH_HOST, port=CH_PORT, database=CH_DATABASE)
+    client = get_client()
 
     # Query to retrieve data for the specified ticker
     query = f"SELECT * FROM {CH_TABLE} WHERE Ticker = '{ticker}'"
@@ -77,9 +130,6 @@ def get_data_from_ch_stock_data(symbol, start_date=None):
     if start_date:
         query += f" AND Date >= '{start_date}'"
 
-    results = client.execute(query)
-    df = pd.DataFrame(results, columns=["Date", "Adj_Close"])
-    df['Date'] = pd.to_datetime(df['Date'])
-
-    # print("Used clickhouse to get df:\n", df)
-    return df.set_index('Date')['Adj_Close']
+    # Columnar results come back as one sequence per column, so the series is built without any per-row tuples
+    dates, adj_close = get_client().execute(query, columnar=True) or ((), ())
+    return pd.Series(adj_close, index=pd.DatetimeIndex(dates, name='Date'), name='Adj_Close', dtype='float64')
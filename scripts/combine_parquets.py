@@ -1,36 +1,51 @@
 # Unused file that was an experimental way to speed up file i/o operations
-import pandas as pd
-from config import STOCKS_DIR
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
-combined_df_list = []
+import pyarrow as pa
+import pyarrow.parquet as pq
+from config import STOCKS_DIR
 
-# Loop over all Parquet files in the directory
-for file in (STOCKS_DIR / 'yahoo_daily/parquets').iterdir():
-    if file.suffix == ".parquet":
-        symbol = file.stem
-        try:
-            df = pd.read_parquet(file)
 
-            # Check if 'Date' index exists
-            if not isinstance(df.index, pd.DatetimeIndex) or df.index.name != 'Date':
-                print(f"Skipping {symbol} - 'Date' index missing or not in expected format.")
+def read_symbol_table(file):
+    """Reads one symbol's parquet as an Arrow table with a Symbol column, or None if it can't be used"""
+    symbol = file.stem
+    try:
+        table = pq.read_table(file)
+
+        # Check if 'Date' index exists, pandas stores the index as a regular column in the file
+        if 'Date' not in table.column_names or not pa.types.is_timestamp(table.schema.field('Date').type):
+            print(f"Skipping {symbol} - 'Date' index missing or not in expected format.")
+            return None
+
+        # Drop the pandas index metadata, Symbol and Date are written as regular columns
+        table = table.replace_schema_metadata(None)
+        print(symbol)
+        return table.append_column('Symbol', pa.array([symbol] * table.num_rows, pa.string()))
+    except Exception as e:
+        print(f"Error processing {symbol}: {e}")
+        return None
+
+
+# Read the Parquet files in parallel, the reads are I/O bound and pyarrow releases the GIL. Files are read a window at
+# a time and each table is written out straight away, so only one window is ever held in memory
+files = iter([file for file in (STOCKS_DIR / 'yahoo_daily/parquets').iterdir() if file.suffix == ".parquet"])
+num_workers = os.cpu_count()
+writer = None
+with ThreadPoolExecutor(max_workers=num_workers) as executor:
+    while window := list(islice(files, num_workers)):
+        for table in executor.map(read_symbol_table, window):
+            if table is None:
                 continue
+            if writer is None:  # The first table's schema is used for the whole file
+                writer = pq.ParquetWriter(STOCKS_DIR / 'combined_data.parquet', table.schema, compression='zstd')
+            try:
+                table = table.select(writer.schema.names).cast(writer.schema)
+            except (KeyError, pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+                print(f"Skipping {table.column('Symbol')[0]} - columns don't match the combined file: {e}")
+                continue
+            writer.write_table(table, row_group_size=100_000)
 
-            # Append the symbol as a level in the multi-index
-            df['Symbol'] = symbol
-            df.set_index('Symbol', append=True, inplace=True)
-
-            # Reorder the multi-index levels for consistency
-            df = df.reorder_levels(['Symbol', 'Date'])
-
-            combined_df_list.append(df)
-            print(symbol)
-        except Exception as e:
-            print(f"Error processing {symbol}: {e}")
-
-# Concatenate all dataframes
-combined_df = pd.concat(combined_df_list, axis=0)
-
-# Save the combined dataframe as a new Parquet file
-combined_df.to_parquet(STOCKS_DIR / 'combined_data.parquet')
-
+if writer is not None:
+    writer.close()
@@ -1,27 +1,34 @@
-import json
+import atexit
 import logging
+import sys
 import time
+import uuid
+from collections import OrderedDict
 from datetime import datetime
+from functools import lru_cache
+from operator import attrgetter
+from types import MappingProxyType
 from multiprocessing import Manager
-from typing import List, Dict, Optional, Iterable, Callable
+from multiprocessing.managers import SyncManager
+from typing import List, Dict, Optional, Iterable, Callable, Tuple
 from finagg import fred
 
+import numpy as np
+import orjson
 import pandas as pd
 from requests import HTTPError
 from unicodedata import normalize
 
-from config import STOCKS_DIR, FRED_DIR, FRED_KEY
+from config import FRED_DIR, FRED_KEY, get_securities_metadata
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARNING)  # Set to WARNING for production; DEBUG for development
 
-etf_metadata = pd.read_csv(STOCKS_DIR / 'FinDB/updated_fin_db_etf_data.csv', index_col='symbol')
-stock_metadata = pd.read_csv(STOCKS_DIR / 'FinDB/updated_fin_db_stock_data.csv', index_col='symbol')
-index_metadata = pd.read_csv(STOCKS_DIR / 'FinDB/updated_fin_db_indices_data.csv', index_col='symbol')
 start_years = ['2010', '2017', '2018', "2019", "2020", '2021', '2022', '2023']
+start_year_timestamps = pd.DatetimeIndex([f'{start_year}-01-01' for start_year in start_years])  # Where each year starts
 observation_end = "2023-06-29"
 
-latex_eq_dict = {
+latex_eq_dict = MappingProxyType({  # Read-only, shared by every FRED series
     1: r"No transformation",
     2: r"$\Delta x_t$",
     3: r"$\Delta^2 x_t$",
@@ -29,47 +36,190 @@ latex_eq_dict = {
     5: r"$\Delta \log(x_t)$",
     6: r"$\Delta^2 \log(x_t)$",
     7: r"$\Delta (x_t/x_{t−1} - 1.0)$"
-}
+})
+
+
+def to_ascii(value: str) -> str:
+    """NFKD normalizes a metadata value and drops what isn't ASCII. Most values are plain ASCII already, which NFKD
+    leaves unchanged, so they're returned as is"""
+    if value.isascii():
+        return value
+    return normalize('NFKD', value).encode('ascii', 'ignore').decode()
+
+
+# Security attributes read from the FinDB metadata, in the order get_metadata_sources stores them in each row
+METADATA_ATTRIBUTES = ('name', 'summary', 'sector', 'industry_group', 'industry', 'market', 'country', 'state', 'city',
+                       'website', 'market_cap')
+# Metadata attributes with few distinct values, interned so every security shares the same string objects
+CATEGORICAL_ATTRIBUTES = frozenset(('sector', 'industry_group', 'industry', 'market', 'country', 'state', 'city',
+                                    'market_cap'))
+
+
+def normalize_metadata_rows(metadata: pd.DataFrame) -> Dict[str, Tuple[str, ...]]:
+    """Every symbol's METADATA_ATTRIBUTES as ASCII strings, '' where a column is missing. Each column is normalized
+    once per distinct value rather than once per security"""
+    metadata = metadata[~metadata.index.duplicated()]
+    columns = []
+    for attribute_name in METADATA_ATTRIBUTES:
+        if attribute_name not in metadata.columns:
+            columns.append([''] * len(metadata))
+            continue
+        values = metadata[attribute_name].tolist()
+        intern = sys.intern if attribute_name in CATEGORICAL_ATTRIBUTES else str
+        normalized = {value: intern(to_ascii(str(value))) for value in set(values)}
+        columns.append([normalized[value] for value in values])
+    return dict(zip(metadata.index.tolist(), zip(*columns)))
+
+
+@lru_cache(maxsize=None)
+def get_metadata_sources() -> Dict[str, Tuple[Tuple[Tuple[str, ...], str], ...]]:
+    """Maps each symbol to its normalized metadata row from each frame that lists it, with the frame's source type.
+    Built once on first use, so creating a Security is a dict lookup instead of index probes and row extraction.
+    Rows keep the order they're applied in, so a symbol in several frames still ends up with the last one's
+    properties"""
+    sources: Dict[str, Tuple[Tuple[Tuple[str, ...], str], ...]] = {}
+    etf_metadata, stock_metadata, index_metadata = get_securities_metadata()
+    for metadata, source_type in ((stock_metadata, 'stock'), (etf_metadata, 'etf'), (index_metadata, 'index')):
+        if metadata is None:
+            continue
+        for symbol, row in normalize_metadata_rows(metadata).items():
+            sources[symbol] = sources.get(symbol, ()) + ((row, source_type),)
+    return sources
+
+
+@lru_cache(maxsize=None)
+def get_fred_md_metadata() -> pd.DataFrame:
+    """Reads the FRED-MD metadata once, the frame is shared by every FRED series and must not be modified in place"""
+    return pd.read_csv(FRED_DIR / 'fred_md_metadata.csv')
+
+
+@lru_cache(maxsize=None)
+def get_fred_md_metadata_rows(id_type: str) -> Dict[str, Dict]:
+    """Metadata rows by their 'fred_md_id' or 'api_id', keeping the first row of any repeated id"""
+    fred_metadata = get_fred_md_metadata()
+    fred_metadata = fred_metadata[fred_metadata[id_type].notna()].drop_duplicates(subset=id_type, keep='first')
+    return fred_metadata.set_index(id_type, drop=False).to_dict(orient='index')
+
+
+@lru_cache(maxsize=None)
+def get_fred_md_data() -> pd.DataFrame:
+    """Reads the FRED-MD dataset once, indexed by date. Shared by every FredmdSeries, copy columns before modifying"""
+    md_data = pd.read_csv(FRED_DIR / 'FRED_MD/MD_2023-08-02.csv')
+    md_data = md_data.rename(columns={'sasdate': 'Date'})
+    md_data['Date'] = pd.to_datetime(md_data['Date'])
+    return md_data.set_index('Date')
+
+
+@lru_cache(maxsize=None)
+def get_slot_names(cls) -> Tuple[str, ...]:
+    """Every slot a class's instances have, from its own and its base classes' __slots__"""
+    return tuple(name for klass in cls.__mro__ for name in klass.__dict__.get('__slots__', ()))
 
 
 class BaseSeries:
+    # Slotted so the thousands of correlated securities held by each saved security don't each carry an instance dict
+    __slots__ = ('symbol', 'name', 'series_data', 'series_data_detrended', 'positive_correlations',
+                 'negative_correlations', 'all_correlations', '_correlation_cache')
+
     def __init__(self, symbol=""):
         self.symbol = symbol
         self.name = symbol
-        self.series_data: Dict[str, pd.Series] = {key: None for key in start_years}  # Dict of each year
-        self.series_data_detrended: Dict[str, pd.DataFrame] = {key: None for key in start_years}
+        self.series_data: Dict[str, pd.Series] = dict.fromkeys(start_years)  # Dict of each year
+        self.series_data_detrended: Dict[str, pd.DataFrame] = dict.fromkeys(start_years)
         self.positive_correlations: Dict[str, List[Security]] = {start_date: [] for start_date in start_years}
         self.negative_correlations: Dict[str, List[Security]] = {start_date: [] for start_date in start_years}
         self.all_correlations: Dict[str, Dict[str, float]] | None = {start_date: {} for start_date in start_years}
 
-    def set_data_years(self, series: pd.Series):
-        for start_year in start_years:
-            # index: pd.DatetimeIndex = pd.DatetimeIndex(series.index)
-            # self.series_data[start_year] = series[index.year >= int(start_year)]
-            self.series_data[start_year] = series[series.index.year >= int(start_year)]
+    def __getstate__(self):
+        """Pickles the set slots as a dict, the same state instances had before they were slotted. Leaves the correlation
+        columns memo out, its entries only mirror the correlation lists"""
+        return {name: getattr(self, name) for name in get_slot_names(type(self))
+                if name != '_correlation_cache' and hasattr(self, name)}
 
-            detrended_series = self.series_data[start_year].diff().dropna()
-            self.series_data_detrended[start_year] = detrended_series.to_frame(name='main')  # !! Not needed
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        if isinstance(state.get('symbol'), str):
+            self.symbol = sys.intern(self.symbol)  # Unpickled symbols are new strings, intern them like __init__ does
+
+    def set_data_years(self, series: pd.Series):
+        if not series.index.is_monotonic_increasing:
+            series = series.sort_index()
+        # Each year starts at a binary searched position, and the differences are taken once over the whole series.
+        # A year's first difference would reach back into the previous year, so its detrended slice starts one later
+        year_starts = series.index.searchsorted(start_year_timestamps)
+        differences = series.diff()
+        # NaNs are dropped and the frame built once, each year is then a slice of it. A year's slice starts after the
+        # differences kept from before start + 1, counted with a cumulative sum over which differences are kept
+        kept = differences.notna().to_numpy()
+        kept_before = np.concatenate(([0], np.cumsum(kept)))
+        detrended = differences[kept].to_frame(name='main')  # !! Not needed
+        for start_year, start in zip(start_years, year_starts):
+            self.series_data[start_year] = series.iloc[start:]
+            self.series_data_detrended[start_year] = detrended.iloc[kept_before[min(start + 1, len(series))]:]
 
     def get_unique_values(self, attribute_name: str, start_date) -> List[str]:
         """Returns a list of a correlation_list's unique values for a given attribute"""
-        unique_values = set()  # TO BE COMBINED TO BASESERIES CLASS
-        unique_values.update(getattr(security, attribute_name) for security in
-                             self.positive_correlations[start_date] if getattr(security, attribute_name))
-        unique_values.update(getattr(security, attribute_name) for security in
-                             self.negative_correlations[start_date] if getattr(security, attribute_name))
-        return list(unique_values)
+        return self.get_all_unique_values((attribute_name,), start_date)[attribute_name]
+
+    def get_correlation_columns(self, attribute_names: Iterable[str], start_date) \
+            -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+        """Columnar form of a start date's positive and negative correlations, one object array per attribute and
+        list, so consumers scan a column instead of every security. Memoized until that date's correlation lists
+        are replaced or appended to"""
+        attribute_names = tuple(attribute_names)
+        positive, negative = self.positive_correlations[start_date], self.negative_correlations[start_date]
+        try:
+            cache = self._correlation_cache
+        except AttributeError:  # Created on first use, unpickled objects don't carry it
+            cache = self._correlation_cache = {}
+        cached = cache.get((attribute_names, start_date))
+        if cached is not None and cached[0] is positive and cached[1] == len(positive) and cached[2] is negative \
+                and cached[3] == len(negative):
+            return cached[4]
+
+        get_attributes = attrgetter(*attribute_names)  # One call per security returns a value for every attribute
+        result = []
+        for securities in (positive, negative):
+            if len(attribute_names) == 1:  # attrgetter returns the bare value rather than a 1-tuple
+                value_columns = [list(map(get_attributes, securities))]
+            else:
+                value_columns = list(zip(*map(get_attributes, securities))) or [() for _ in attribute_names]
+            columns = {}
+            for attribute_name, values in zip(attribute_names, value_columns):
+                column = np.empty(len(values), dtype=object)  # Filled in place, np.array would unpack sequences
+                column[:] = values
+                columns[attribute_name] = column
+            result.append(columns)
+        result = tuple(result)
+        cache[(attribute_names, start_date)] = (positive, len(positive), negative, len(negative), result)
+        return result
+
+    def get_all_unique_values(self, attribute_names: Iterable[str], start_date) -> Dict[str, List[str]]:
+        """Returns a correlation_list's unique values for each given attribute, deduplicated with pd.unique over the
+        memoized correlation columns. Values are listed in the order they're first seen, positive correlations first,
+        so the dropdowns keep a stable order"""
+        positive_columns, negative_columns = self.get_correlation_columns(attribute_names, start_date)
+        return {attribute_name: [value for value in pd.unique(np.concatenate((positive_column,
+                                                                            negative_columns[attribute_name])))
+                                 if value]
+                for attribute_name, positive_column in positive_columns.items()}
 
 
 class Security(BaseSeries):
+    __slots__ = ('summary', 'sector', 'industry_group', 'industry', 'market', 'is_otc', 'country', 'state', 'city',
+                 'website', 'market_cap', 'source', 'correlation')
+
     def __init__(self, symbol: str):
         super().__init__()
-        self.symbol: str = symbol
+        # Interned so that symbols of equal securities are the same object and __eq__ is an identity check
+        self.symbol: str = sys.intern(symbol)
         self.summary: Optional[str] = None
         self.sector: Optional[str] = None
         self.industry_group: Optional[str] = None
         self.industry: Optional[str] = None
         self.market: Optional[str] = None
+        self.is_otc: bool = False  # Whether market is an OTC market, checked once here instead of by every filter
         self.country: Optional[str] = None
         self.state: Optional[str] = None
         self.city: Optional[str] = None
@@ -89,47 +239,37 @@ class Security(BaseSeries):
     def set_correlation(self, value: float) -> None:
         self.correlation = value
 
-    def set_properties_from_metadata(self, metadata: pd.Series, source_type: str) -> None:
-        def set_property(name_of_attribute: str, default_val: str = 'Missing') -> None:
-            # If name is 'one', 'two', or 'RH', set the attribute to 'Missing' and return
-            if self.name in ('one', 'two', 'RH'):
-                setattr(self, name_of_attribute, default_val)
-                return
-            value = metadata.get(name_of_attribute, '')  # Otherwise, get the value of the attribute from the metadata
-            # Normalize the value in cases of non-standard values
-            normalized_value = normalize('NFKD', str(value)).encode('ascii', 'ignore').decode() or None
-            setattr(self, name_of_attribute, normalized_value or default_val)
-
-        # Safely set the name attribute
-        self.name = normalize('NFKD', str(metadata.get('name', ''))).encode('ascii', 'ignore').decode()
-
-        for attribute_name in ['summary', 'sector', 'industry_group', 'industry', 'market', 'country', 'state', 'city',
-                               'website']:  # Use the loop to set the attributes
-            set_property(attribute_name)
-
-        self.market_cap = \
-            normalize('NFKD', str(metadata.get('market_cap', ''))).encode('ascii', 'ignore').decode() or None
-        self.source = source_type
+    def set_properties_from_metadata(self, metadata: Tuple[str, ...], source_type: str) -> None:
+        """Sets the metadata attributes from a row built by get_metadata_sources, already ASCII normalized"""
+        properties = dict(zip(METADATA_ATTRIBUTES, metadata))
+        self.name = properties.pop('name')
+        market_cap = properties.pop('market_cap')
 
-    def get_symbol_name_and_type(self) -> None:
-        if stock_metadata is not None and self.symbol in stock_metadata.index:  # Check for Stock metadata
-            stock_data = stock_metadata.loc[self.symbol]
-            self.set_properties_from_metadata(stock_data, 'stock')
+        for attribute_name, value in properties.items():
+            # If name is 'one', 'two', or 'RH', set the attribute to 'Missing'
+            setattr(self, attribute_name, 'Missing' if self.name in ('one', 'two', 'RH') else value or 'Missing')
 
-        if etf_metadata is not None and self.symbol in etf_metadata.index:  # Check for ETF metadata
-            etf_data = etf_metadata.loc[self.symbol]
-            self.set_properties_from_metadata(etf_data, 'etf')
+        self.market_cap = market_cap or None
+        self.source = source_type
+        self.is_otc = 'OTC ' in self.market
+
+    def __setstate__(self, state):
+        """Fills in is_otc for securities pickled before it was added"""
+        super().__setstate__(state)
+        if 'is_otc' not in state:
+            self.is_otc = 'OTC ' in (self.market or '')
 
-        if index_metadata is not None and self.symbol in index_metadata.index:  # Check for Index metadata
-            index_data = index_metadata.loc[self.symbol]
-            self.set_properties_from_metadata(index_data, 'index')
+    def get_symbol_name_and_type(self) -> None:
+        # Stock, then ETF, then Index metadata, only the frames that list the symbol are applied
+        for metadata, source_type in get_metadata_sources().get(self.symbol, ()):
+            self.set_properties_from_metadata(metadata, source_type)
 
     def __hash__(self) -> int:
         return hash(self.symbol)  # Make the instance hashable using its symbol attribute
 
     def __eq__(self, other) -> bool:
         if isinstance(other, Security):
-            return self.symbol == other.symbol
+            return self is other or self.symbol == other.symbol
         return False
 
     def __str__(self) -> str:
@@ -163,12 +303,14 @@ class Security(BaseSeries):
 
 
 class FredSeriesBase(BaseSeries):
+    __slots__ = ('fred_md_id', 'api_id', 'source_title', 'source_link', 'release_title', 'release_link', 'tcode',
+                 'frequency', 'latex_equation')
+
     def __init__(self, symbol, id_type):
         super().__init__()
-        self.symbol = symbol
-        fred_metadata: pd.DataFrame = pd.read_csv(FRED_DIR / 'fred_md_metadata.csv')
+        self.symbol = sys.intern(symbol)
         try:
-            row: pd.Series = fred_metadata[fred_metadata[id_type] == symbol].iloc[0]
+            row: Dict = get_fred_md_metadata_rows(id_type)[symbol]
             self.fred_md_id = row['fred_md_id']
             self.api_id = row['api_id']
             self.name = row['title']
@@ -179,7 +321,7 @@ class FredSeriesBase(BaseSeries):
             self.tcode = row['tcode']
             self.frequency = row['frequency']
             self.latex_equation = self.get_latex_equation()
-        except IndexError:
+        except KeyError:
             na_str = 'N/A'
             self.fred_md_id = symbol
             self.api_id = symbol
@@ -222,15 +364,17 @@ class FredSeriesBase(BaseSeries):
         return hash(self.symbol)  # Make the instance hashable using its symbol attribute
 
     def __eq__(self, other) -> bool:
-        if isinstance(other, Security):
-            return self.symbol == other.symbol
+        if isinstance(other, FredSeriesBase):
+            return self is other or self.symbol == other.symbol
         return False
 
     def to_dict(self):
-        return self.__dict__
+        return self.__getstate__()
 
 
 class FredapiSeries(FredSeriesBase):
+    __slots__ = ()
+
     def __init__(self, api_symbol: str, revised: bool, save_data: bool = False, custom_data: pd.Series = None):
         super().__init__(api_symbol, 'api_id')
         if not revised:
@@ -289,6 +433,8 @@ class FredapiSeries(FredSeriesBase):
 
 
 class FredmdSeries(FredSeriesBase):
+    __slots__ = ()
+
     def __init__(self, fred_md_symbol: str):
         super().__init__(fred_md_symbol, 'fred_md_id')
         df = self.set_fred_series()
@@ -296,55 +442,100 @@ class FredmdSeries(FredSeriesBase):
 
     def set_fred_series(self):
         """For getting a series from the FRED-MD dataset"""
-        md_data = pd.read_csv(FRED_DIR / 'fred_md/MD_2023-08-02.csv')
-        md_data = md_data.rename(columns={'sasdate': 'Date'})
-        md_data['Date'] = pd.to_datetime(md_data['Date'])
-        md_data = md_data.set_index('Date')[self.fred_md_id]  # Extract the 'series_id' column for correlation
+        return get_fred_md_data()[self.fred_md_id].copy()  # Extract the 'series_id' column for correlation
+
 
-        return md_data
+# Each process's local copies of SharedMemoryCache entries, by cache id. Module level, since a cache is pickled again
+# for every task it's passed to, and the copies should outlive any one of those tasks
+local_cache_entries: Dict[str, OrderedDict] = {}
+
+
+@lru_cache(maxsize=None)
+def get_manager() -> SyncManager:
+    """Starts the manager process on first use and shares it between every SharedMemoryCache, rather than spawning a
+    new server process per cache. It's shut down at exit, shutdown is a no-op in processes that didn't start it"""
+    manager = Manager()
+    atexit.register(manager.shutdown)
+    return manager
 
 
 class SharedMemoryCache:
-    def __init__(self):
-        manager = Manager()
-        self.data_dict = manager.dict()
-        self.hits = manager.Value('i', 0)  # Create a shared integer with initial value 0
-        self.misses = manager.Value('i', 0)  # Create a shared integer with initial value 0
+    LOCAL_SIZE = 512  # Most entries each process keeps locally in front of the managed dict, never more than maxsize
+
+    def __init__(self, maxsize: Optional[int] = None):
+        self.data_dict = get_manager().dict()
+        self.maxsize = maxsize  # Oldest entries are evicted once this many are stored, None for unbounded
+        self.local_size = self.LOCAL_SIZE if maxsize is None else min(self.LOCAL_SIZE, maxsize)
+        self.cache_id = uuid.uuid4().hex
+        # Counted per process, updating managed counters would cost two more round trips to the manager per access
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['hits'] = state['misses'] = 0  # A copy sent to another process counts its own accesses
+        return state
+
+    def local_entries(self) -> OrderedDict:
+        try:
+            return local_cache_entries[self.cache_id]
+        except KeyError:  # Only build the OrderedDict once per process, setdefault would build one on every access
+            return local_cache_entries.setdefault(self.cache_id, OrderedDict())
+
+    def remember_locally(self, symbol, data):
+        local_entries = self.local_entries()
+        local_entries[symbol] = data
+        local_entries.move_to_end(symbol)
+        if len(local_entries) > self.local_size:
+            local_entries.popitem(last=False)
 
     def set(self, symbol, data):
+        if self.maxsize is not None and symbol not in self.data_dict and len(self.data_dict) >= self.maxsize:
+            # The managed dict keeps insertion order, so its first key is the oldest entry
+            oldest = next(iter(self.data_dict.keys()))
+            self.data_dict.pop(oldest, None)
+            self.local_entries().pop(oldest, None)  # Don't keep the evicted entry alive in this process either
         self.data_dict[symbol] = data
+        self.remember_locally(symbol, data)
 
     def get(self, symbol):
-        data = self.data_dict.get(symbol, None)
+        """Checks this process's local entries first, only a miss there goes through the manager"""
+        local_entries = self.local_entries()
+        data = local_entries.get(symbol)
+        if data is not None:
+            local_entries.move_to_end(symbol)
+        else:
+            data = self.data_dict.get(symbol, None)
+            if data is not None:
+                self.remember_locally(symbol, data)
         if data is not None:
-            self.hits.value += 1
+            self.hits += 1
         else:
-            self.misses.value += 1
+            self.misses += 1
         return data
 
     def get_hits(self):
-        return self.hits.value
+        return self.hits
 
     def get_misses(self):
-        return self.misses.value
+        return self.misses
 
 
-class EnhancedEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if hasattr(obj, 'tolist'):
-            return obj.tolist()
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return super(EnhancedEncoder, self).default(obj)
+def enhanced_default(obj):
+    """Converts what orjson can't serialize natively, e.g. non-contiguous or object arrays, pandas objects and sets"""
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, Iterable) and not isinstance(obj, str):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
 
 
-class EnhancedEncoder2(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        if isinstance(obj, Iterable) and not isinstance(obj, str):
-            return list(obj)
-        return super(EnhancedEncoder2, self).default(obj)
+def enhanced_dumps(obj) -> bytes:
+    """Serializes obj to JSON with orjson, which encodes numpy arrays and datetimes natively. Non-string keys are
+    written as strings, as json.dumps does, rather than rejected"""
+    return orjson.dumps(obj, default=enhanced_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
 
 
 SERIES_DICT = {
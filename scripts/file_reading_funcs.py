@@ -1,21 +1,29 @@
+import json
 import logging
+import os
 import pickle
 import threading
 import traceback
+from collections import OrderedDict
 from functools import lru_cache
 from functools import wraps
-from typing import List, Set
+from pathlib import Path
+from typing import Dict, Iterable, List, Set
 
 import financedatabase as fd
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import yfinance as yf
 from finagg import fred
 
-from config import STOCKS_DIR, FRED_DIR, DATA_DIR, FRED_KEY
+from config import STOCKS_DIR, FRED_DIR, DATA_DIR, FRED_KEY, get_securities_metadata
 from scripts.clickhouse_functions import get_data_from_ch_stock_data
-from scripts.correlation_constants import Security, logger, FredmdSeries, FredapiSeries, \
-    etf_metadata, index_metadata, stock_metadata, observation_end
+from scripts.numba_functions import detrend_values
+from scripts.correlation_constants import Security, logger, FredmdSeries, FredapiSeries, observation_end, \
+    get_fred_md_metadata, get_fred_md_data
 
 # Configure the logger at the module level
 log_format = '%(asctime)s - %(message)s'
@@ -33,6 +41,24 @@ logging.basicConfig(filename='cache_info.log', level=logging.INFO,
 
 cache_lock = threading.Lock()
 shared_cache = {}
+preloaded_series: Dict[str, pd.Series] = {}  # Yahoo series read ahead by preload_series_data, guarded by cache_lock
+
+# File name suffix of the pickled security objects saved for each source
+SOURCE_FILE_SUFFIXES = {'SECURITIES': '', 'FREDMD': '_fred', 'FREDAPI': '_fredapi', 'FREDAPIOG': '_fredapi_og'}
+
+# Saved security objects by pickle path, with the file's mtime when they were loaded or saved
+saved_securities_lock = threading.Lock()
+saved_securities: OrderedDict = OrderedDict()
+SAVED_SECURITIES_CACHE_SIZE = 128
+
+
+def remember_saved_security(file_path, mtime_ns: int, security) -> None:
+    """Keeps a security that matches its pickle's current mtime, evicting the least recently used one when full"""
+    with saved_securities_lock:
+        saved_securities[file_path] = (mtime_ns, security)
+        saved_securities.move_to_end(file_path)
+        if len(saved_securities) > SAVED_SECURITIES_CACHE_SIZE:
+            saved_securities.popitem(last=False)
 
 
 def cache_info(func):
@@ -46,15 +72,22 @@ def cache_info(func):
     return wrapper
 
 
-@lru_cache(maxsize=None)
+@lru_cache(maxsize=512)
 def read_series_data(symbol: str, source: str) -> pd.Series | None:
-    """Looks for a symbol in yahoo_daily directory and returns its 'Adj Close' column."""
+    """Looks for a symbol in yahoo_daily directory and returns its 'Adj Close' column. Results are memoized per
+    (symbol, source), so the returned series is shared and must not be modified in place."""
     with cache_lock:
         try:
             if source == 'yahoo':
+                series = preloaded_series.pop(symbol, None)
+                if series is not None:
+                    return series
                 file_path = STOCKS_DIR / f'yahoo_daily/parquets/{symbol}.parquet'
-                series = pd.read_parquet(file_path)
-                return series['Adj Close']
+                # Only the two needed columns are decoded, and they're built straight into a series without going
+                # through a DataFrame of every column
+                table = pq.read_table(file_path, columns=['Date', 'Adj Close'], memory_map=True)
+                return pd.Series(table.column('Adj Close').to_numpy(), name='Adj Close',
+                                 index=pd.DatetimeIndex(table.column('Date').to_numpy(), name='Date'))
             elif source == 'alpaca':
                 print("Alpaca coming soon")
             else:
@@ -71,11 +104,41 @@ def read_series_data(symbol: str, source: str) -> pd.Series | None:
             return trace_series
 
 
+def preload_series_data(symbols: Iterable[str]) -> None:
+    """Reads the yahoo parquets of many symbols in one multithreaded dataset scan, rather than opening each file when
+    its symbol is read. read_series_data hands out each preloaded series once, call clear_preloaded_series_data
+    afterwards to drop any that weren't asked for"""
+    paths = [path for path in (str(STOCKS_DIR / f'yahoo_daily/parquets/{symbol}.parquet') for symbol in symbols)
+             if os.path.exists(path)]
+    if not paths:
+        return
+    # Each scanned batch is tagged with the file it came from, so rows are grouped by file as they're read instead of
+    # through a per-row file name column. Batches of a file arrive in order
+    batches_by_path: Dict[str, List[pa.RecordBatch]] = {}
+    for tagged_batch in ds.dataset(paths, format='parquet').scanner(columns=['Date', 'Adj Close']).scan_batches():
+        batches_by_path.setdefault(tagged_batch.fragment.path, []).append(tagged_batch.record_batch)
+
+    series_by_symbol = {}
+    for path, batches in batches_by_path.items():
+        table = pa.Table.from_batches(batches)
+        series_by_symbol[Path(path).stem] = pd.Series(table.column('Adj Close').to_numpy(), name='Adj Close',
+                                                      index=pd.DatetimeIndex(table.column('Date').to_numpy(),
+                                                                             name='Date'))
+    with cache_lock:
+        preloaded_series.update(series_by_symbol)
+
+
+def clear_preloaded_series_data() -> None:
+    with cache_lock:
+        preloaded_series.clear()
+
+
 # @cache_info
 @lru_cache(maxsize=None)
 def original_get_validated_security_data(symbol: str, start_date: str, end_date: str, source: str, dl_data: bool,
                                          use_ch: bool) -> pd.DataFrame:
-    """Get security data from file, make sure it's within range and continuous"""
+    """Get security data from file, make sure it's within range and continuous. Memoized, the returned frame is
+    shared between callers and must not be modified in place."""
     if dl_data:
         security_data = download_yfin_data(symbol)
     elif use_ch:
@@ -101,10 +164,12 @@ def original_get_validated_security_data(symbol: str, start_date: str, end_date:
         # logger.warning(f"{symbol:<6} hasn't been on the market for the required duration. Skipping...")
         raise AttributeError(f"{symbol:<6} hasn't been on the market for the required duration. Skipping...")
 
-    # Detrend
-    security_data = security_data.diff().dropna()
-    security_data = security_data[security_data.index.year >= int(start_date[:4])]
-    security_data = security_data.to_frame(name='symbol')
+    # Detrend, only from the start year on. The window starts one row earlier, since the start year's first difference
+    # is taken from the last value before it
+    start = security_data.index.searchsorted(start_year_timestamp(start_date))
+    window = security_data.iloc[max(start - 1, 0):]
+    differences, keep = detrend_values(window.to_numpy(dtype=np.float64))
+    security_data = pd.DataFrame({'symbol': differences[keep]}, index=window.index[1:][keep])
 
     return security_data
 
@@ -218,42 +283,66 @@ def pickle_securities_objects(security: Security | FredapiSeries | FredmdSeries,
     """Pickles a security object to re-use the calculations"""
     symbol = security.symbol
 
-    file_path = DATA_DIR / f'Graphs/pickled_securities_objects/{symbol}.pkl'
-    if source == 'FREDMD':
-        file_path = DATA_DIR / f'Graphs/pickled_securities_objects/{symbol}_fred.pkl'
-    elif source == 'FREDAPI':
-        file_path = DATA_DIR / f'Graphs/pickled_securities_objects/{symbol}_fredapi.pkl'
-    elif source == 'FREDAPIOG':
-        file_path = DATA_DIR / f'Graphs/pickled_securities_objects/{symbol}_fredapi_og.pkl'
+    suffix = SOURCE_FILE_SUFFIXES.get(source, '')  # Any other source, e.g. 'yahoo', is saved as a security
+    file_path = DATA_DIR / f'Graphs/pickled_securities_objects/{symbol}{suffix}.pkl'
     # Save dict of base security id's, and symbols that correlate with them for later use
     with open(file_path, 'wb') as pickle_file:
         pickle.dump(security, pickle_file)
 
+    # Small sidecar listing which start years have correlations, so they can be checked without unpickling
+    with open(file_path.with_suffix('.years.json'), 'w') as years_file:
+        json.dump(sorted(year for year, correlations in security.positive_correlations.items() if correlations),
+                  years_file)
+
+    # The object just written is what loading the file would return, so the next load doesn't read it back
+    remember_saved_security(file_path, file_path.stat().st_mtime_ns, security)
+
 
 def load_saved_securities(symbol: str, source: str) -> Security | FredapiSeries | FredmdSeries:
-    """Loads and returns saved security objects from pickle files."""
-    if source == 'SECURITIES':
-        file_path = DATA_DIR / f'Graphs/pickled_securities_objects/{symbol}.pkl'
-    elif source == 'FREDMD':
-        file_path = DATA_DIR / f'Graphs/pickled_securities_objects/{symbol}_fred.pkl'
-    elif source == 'FREDAPI':
-        file_path = DATA_DIR / f'Graphs/pickled_securities_objects/{symbol}_fredapi.pkl'
-    elif source == 'FREDAPIOG':
-        file_path = DATA_DIR / f'Graphs/pickled_securities_objects/{symbol}_fredapi_og.pkl'
-    else:
+    """Loads and returns saved security objects from pickle files. Results are memoized until the pickle's mtime
+    changes, so returned objects are shared and should be treated as read-only."""
+    if source not in SOURCE_FILE_SUFFIXES:
         raise ValueError(f"Unrecognized source: {source}")
+    file_path = DATA_DIR / f'Graphs/pickled_securities_objects/{symbol}{SOURCE_FILE_SUFFIXES[source]}.pkl'
 
-    if file_path.exists():
-        with open(file_path, 'rb') as pickle_file:
-            security = pickle.load(pickle_file)
-        return security
-    else:
+    try:
+        mtime_ns = file_path.stat().st_mtime_ns
+    except FileNotFoundError:
         print(f"No saved data found for symbol: {symbol}")
+        return None
+
+    with saved_securities_lock:
+        cached = saved_securities.get(file_path)
+        if cached is not None and cached[0] == mtime_ns:
+            saved_securities.move_to_end(file_path)
+            return cached[1]
+
+    with open(file_path, 'rb') as pickle_file:
+        security = pickle.load(pickle_file)
+    remember_saved_security(file_path, mtime_ns, security)
+    return security
+
+
+def get_saved_correlation_years(symbol: str, source: str) -> Set[str]:
+    """Returns the start years a saved security has correlations for, from its sidecar file if one was written."""
+    if source not in SOURCE_FILE_SUFFIXES:
+        raise ValueError(f"Unrecognized source: {source}")
+    years_path = DATA_DIR / f'Graphs/pickled_securities_objects/{symbol}{SOURCE_FILE_SUFFIXES[source]}.years.json'
+
+    if years_path.exists():
+        with open(years_path, 'r') as years_file:
+            return set(json.load(years_file))
+
+    # Saved before sidecars existed, fall back to loading the security itself
+    security = load_saved_securities(symbol, source)
+    if security is None:
+        return set()
+    return {year for year, correlations in security.positive_correlations.items() if correlations}
 
 
 def get_fred_md_series_list() -> Set[FredmdSeries]:
     """Create list of FredSeries objects from fred_md_metadata csv"""
-    fred_md_metadata = pd.read_csv(FRED_DIR / 'fred_md_metadata.csv')
+    fred_md_metadata = get_fred_md_metadata()
 
     # Filter rows where 'fred_md_id' is not null and not empty
     valid_rows = fred_md_metadata[pd.notnull(fred_md_metadata['fred_md_id']) & (fred_md_metadata['fred_md_id'] != '')]
@@ -266,22 +355,25 @@ def get_fred_md_series_list() -> Set[FredmdSeries]:
 
 def get_fred_md_series_data(series_id):
     """For getting a series from the FRED-MD dataset"""
-    md_data = pd.read_csv(FRED_DIR / 'FRED_MD/MD_2023-08-02.csv')
-    md_data = md_data.rename(columns={'sasdate': 'Date'})
-    md_data['Date'] = pd.to_datetime(md_data['Date'])
-
     # Extract the 'series_id' column for correlation
-    md_data = md_data.set_index('Date')[series_id]
+    return get_fred_md_data()[series_id].copy()
+
+
+@lru_cache(maxsize=64)
+def start_timestamp(start_date: str) -> pd.Timestamp:
+    """Parses a YYYY or YYYY-MM-DD start date once, the same few dates are used for every trace and security"""
+    return pd.to_datetime(start_date)
+
 
-    return md_data
+@lru_cache(maxsize=64)
+def start_year_timestamp(start_date: str) -> pd.Timestamp:
+    """January 1st of a start date's year"""
+    return pd.Timestamp(year=int(start_date[:4]), month=1, day=1)
 
 
 def fit_data_to_time_range(series_data, start_date):
-    # Makes sure series_data starts at the start date, or its earliest datapoint
-    start_datetime = pd.to_datetime(start_date)
-    start_datetime = max(start_datetime, series_data.index.min())
-    series_data = series_data.loc[start_datetime:]
-    return series_data
+    # Makes sure series_data starts at the start date, or its earliest datapoint. Index is sorted, so binary search it
+    return series_data.iloc[series_data.index.searchsorted(start_timestamp(start_date)):]
 
 
 def initialize_fin_db_stock_metadata():
@@ -292,6 +384,7 @@ def initialize_fin_db_stock_metadata():
 
 def delete_symbol_from_metadata(symbol: str):
     """For when cleaning out the metadata files to remove junk data."""
+    etf_metadata, stock_metadata, index_metadata = get_securities_metadata()
     with open(STOCKS_DIR / 'all_stock_symbols.txt', 'r') as file:
         all_symbols = file.read().splitlines()
 
@@ -339,21 +432,18 @@ def download_findb_data():  # Test if this works properly later
 
 def build_symbol_list(etf: bool = False, stock: bool = True, index: bool = False) -> List[str]:
     """Build list of symbols from the given data sources."""
+    etf_metadata, _, index_metadata = get_securities_metadata()
     symbols = []
 
     if etf:
-        etf_metadata_filtered = etf_metadata[etf_metadata['market'].notna() &
-                                             etf_metadata['exchange'].notna() &
-                                             etf_metadata['family'].notna()]
+        etf_metadata_filtered = etf_metadata.dropna(subset=['market', 'exchange', 'family'])
         symbols.extend(etf_metadata_filtered.index.tolist())
 
     if stock:
 
         # Use a txt file with all stock symbols
-        stock_composite_list = []
-        with open(STOCKS_DIR / 'all_stock_symbols.txt', 'r') as f:
-            for line in f.readlines():
-                stock_composite_list.append(line.strip())
+        lines = (STOCKS_DIR / 'all_stock_symbols.txt').read_text().splitlines()
+        stock_composite_list = [symbol for symbol in map(str.strip, lines) if symbol]
 
         # # Use only data from the metadata csv
         # stock_metadata_filtered = \
@@ -363,20 +453,19 @@ def build_symbol_list(etf: bool = False, stock: bool = True, index: bool = False
         symbols.extend(stock_composite_list)
 
     if index:
-        index_metadata_filtered = index_metadata[index_metadata['name'].notna()]
+        index_metadata_filtered = index_metadata.dropna(subset=['name'])
         symbols.extend(index_metadata_filtered.index.tolist())
 
     return symbols
 
 
 def get_all_fred_api_series_ids() -> List[str]:
-    with open(FRED_DIR / 'FRED_all_series.txt', 'r') as f:
-        fred_api_symbols = [symbol.strip() for symbol in f.readlines()]
+    lines = (FRED_DIR / 'FRED_all_series.txt').read_text().splitlines()
 
-    return fred_api_symbols
+    return [symbol for symbol in map(str.strip, lines) if symbol]
 
 
 def get_all_fredmd_series_ids() -> List[str]:
-    fred_md_metadata = pd.read_csv(FRED_DIR / 'fred_md_metadata.csv')
+    fred_md_metadata = get_fred_md_metadata()
 
     return fred_md_metadata[fred_md_metadata['fred_md_id'].notna()]['fred_md_id'].tolist()
@@ -0,0 +1,53 @@
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def normalize_values(values: np.ndarray) -> np.ndarray:
+    """Scale values between 0 and 1, ignoring NaNs when finding the min and max."""
+    if values.size == 0:
+        return values.copy()
+    minimum = np.nanmin(values)
+    return (values - minimum) / (np.nanmax(values) - minimum)
+
+
+@njit(cache=True)
+def detrend_values(values: np.ndarray):
+    """First difference of values. Also returns a mask of the differences that aren't NaN, so that
+    values[1:][mask] lines up with the differences that are kept."""
+    size = max(values.size - 1, 0)
+    differences = np.empty(size)
+    keep = np.empty(size, dtype=np.bool_)
+    for i in range(size):
+        differences[i] = values[i + 1] - values[i]
+        keep[i] = not np.isnan(differences[i])
+    return differences, keep
+
+
+@njit(cache=True)
+def select_filtered_indices(source_codes: np.ndarray, source_shown: np.ndarray, source_is_stock: np.ndarray,
+                            attribute_codes: np.ndarray, attribute_allowed: np.ndarray, is_otc: np.ndarray,
+                            apply_metadata_filters: bool, exclude_otc: bool, limit: int) -> np.ndarray:
+    """Indices of the first `limit` rows that pass the source and, for stocks, the metadata filters. Row i's
+    attribute a passes if attribute_allowed[a, attribute_codes[a, i]], sources are looked up the same way."""
+    selected = np.empty(min(limit, source_codes.size), dtype=np.int64)
+    count = 0
+    for i in range(source_codes.size):
+        if count == selected.size:  # Stop as soon as enough rows were found
+            break
+        source = source_codes[i]
+        if not source_shown[source]:
+            continue
+        if apply_metadata_filters and source_is_stock[source]:
+            if exclude_otc and is_otc[i]:
+                continue
+            passed = True
+            for a in range(attribute_codes.shape[0]):
+                if not attribute_allowed[a, attribute_codes[a, i]]:
+                    passed = False
+                    break
+            if not passed:
+                continue
+        selected[count] = i
+        count += 1
+    return selected[:count]
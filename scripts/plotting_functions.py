@@ -1,15 +1,24 @@
-import json
+import logging
 import subprocess
 from typing import List
 
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
 from config import DATA_DIR
-from scripts.correlation_constants import Security, EnhancedEncoder, FredmdSeries, FredapiSeries, \
+from scripts.correlation_constants import Security, enhanced_dumps, FredmdSeries, FredapiSeries, \
     FredSeriesBase
 from scripts.file_reading_funcs import read_series_data, fit_data_to_time_range
+from scripts.numba_functions import normalize_values, detrend_values
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.WARNING)  # Set to WARNING for production; DEBUG for development
+
+# With delay=True the file isn't opened until the first record, importing the module starts no thread and opens nothing
+logger.addHandler(logging.FileHandler('debug_file.txt', delay=True))
+logger.propagate = False  # Keep these records out of the root logger's cache_info.log
 
 
 def set_comment_text(main_security: FredmdSeries | FredapiSeries | Security) -> str:
@@ -65,7 +74,7 @@ class CorrelationPlotter:
                 trace_series = trace_series.resample('MS').first()
 
             if show_detrended:
-                trace_series = trace_series.diff().dropna()
+                trace_series = detrend_data(trace_series)
 
             fig.add_trace(go.Scatter(x=trace_series.index, y=trace_series, mode='lines',
                                      name=f'{security.correlation:.3}  {symbol} - {name}'), row=row, col=1)
@@ -92,7 +101,7 @@ class CorrelationPlotter:
                 trace_series = trace_series.resample('MS').first()
 
             if show_detrended:
-                trace_series = trace_series.diff().dropna()
+                trace_series = detrend_data(trace_series)
 
             fig.add_trace(go.Scatter(x=trace_series.index, y=trace_series, mode='lines',
                                      name=f'{security.correlation:.3}  {symbol} - {name}'), row=row, col=1)
@@ -110,16 +119,10 @@ class CorrelationPlotter:
                                    num_rows: int = 2):
         """Plotting the base series against its correlated series"""
 
-        args_dict = locals().copy()
-        args_dict.pop('self')  # Remove 'self' from the dictionary
-
-        with open('debug_file.txt', 'a') as f:
-            f.write('\n')
-
-        # Write the arguments to a file for debugging
-        with open('debug_file.txt', 'a') as f:
-            for key, value in args_dict.items():
-                f.write(f'{key}: {value}\n')
+        if logger.isEnabledFor(logging.DEBUG):  # Formatting every argument is skipped entirely when not debugging
+            args_dict = locals().copy()
+            args_dict.pop('self')  # Remove 'self' from the dictionary
+            logger.debug('\n%s', '\n'.join(f'{key}: {value}' for key, value in args_dict.items()))
 
         start_year = start_date[:4]
         main_security_data: pd.Series = main_security.series_data[start_year]
@@ -130,7 +133,7 @@ class CorrelationPlotter:
             main_security_data = main_security_data.resample('MS').first()
 
         if show_detrended:
-            main_security_data = main_security_data.diff().dropna()
+            main_security_data = detrend_data(main_security_data)
 
         # Set up the subplots layout
         fig = make_subplots(rows=num_rows, cols=1)
@@ -217,14 +220,20 @@ def show_popup_plot(symbol: str, fig):
 
 def normalize_data(series: pd.Series):
     """Normalize a pandas Series by scaling its values between 0 and 1."""
-    return (series - series.min()) / (series.max() - series.min())
+    return pd.Series(normalize_values(series.to_numpy(dtype=np.float64)), index=series.index, name=series.name)
+
+
+def detrend_data(series: pd.Series):
+    """Equivalent to series.diff().dropna(), computed on the raw values."""
+    differences, keep = detrend_values(series.to_numpy(dtype=np.float64))
+    return pd.Series(differences[keep], index=series.index[1:][keep], name=series.name)
 
 
 def save_plot(symbol: str, fig):
     # Graphs/json_plots/AAPL_2010_plot.json
     json_file_path = DATA_DIR / f'Graphs/json_plots/{symbol}_plot.json'
-    with open(json_file_path, 'w') as f:
-        json.dump(fig.to_dict(), f, cls=EnhancedEncoder)
+    with open(json_file_path, 'wb') as f:
+        f.write(enhanced_dumps(fig.to_dict()))
 
 
 if __name__ == '__main__':
@@ -18,3 +18,27 @@
 //         return hiddenInput.value;
 //     }
 // };
+
+if (!window.dash_clientside) {
+    window.dash_clientside = {};
+}
+
+window.dash_clientside.clientside = {
+    // Makes STOCK ETF INDEX buttons change color, an odd number of clicks means the source is selected
+    update_button_styles: function(etf_clicks, stock_clicks, index_clicks) {
+        const selected_style = {'flex': 1, 'background-color': '#00498B', 'color': 'white'};
+        const not_selected_style = {'flex': 1, 'background-color': '#1e1e2a', 'color': 'white'};
+
+        return [etf_clicks, stock_clicks, index_clicks].map(
+            clicks => clicks % 2 === 1 ? selected_style : not_selected_style
+        );
+    },
+
+    // Collapse the filtering buttons when the "Toggle Filters" button is clicked
+    toggle_collapse: function(n, is_open) {
+        if (n === null || n === undefined) {
+            return is_open;
+        }
+        return !is_open;
+    }
+};